@@ -3,16 +3,20 @@
 # Licensed under the GNU GPL v3 or later. See LICENSE for details.
 
 import os
+import json
+import asyncio
 from datetime import timedelta
-from fastapi import (FastAPI, Depends, 
-    Request, Response, HTTPException, status, BackgroundTasks)
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import (FastAPI, Depends, Query, UploadFile,
+    Request, Response, HTTPException, status, WebSocket, WebSocketDisconnect)
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
 from middleware.request_ctx import RequestContextMiddleware
-from contextlib import asynccontextmanager
+from middleware.rate_limit import TokenBucketLimiter, check_rate_limit, get_rate_limit_key
+from contextlib import aclosing, asynccontextmanager
 import uuid as uuid_pkg
-from sqlmodel import Session, select, update, delete, desc, col
+from sqlmodel import select, update, delete, desc, col
+from sqlmodel.ext.asyncio.session import AsyncSession
 from fastapi.templating import Jinja2Templates
 from jwt.exceptions import (
     InvalidTokenError, ExpiredSignatureError,
@@ -20,7 +24,11 @@ from jwt.exceptions import (
     InvalidJTIError
 )
 from core.settings import settings
-from core.logging import setup_logging
+from core.logging import setup_logging, stop_logging, get_logging_stats
+from core.cache import TTLCache
+from core.tasks import start_periodic_task, stop_tasks
+from core.metrics import (collect, register_gauge, write_snapshot, remove_snapshot, 
+    read_snapshots, merge_snapshots, render_prometheus)
 from core.security_events import (
     get_client_ip,
     log_password_reset_code_generation,
@@ -30,45 +38,128 @@ from core.security_events import (
     log_login_successful,
     log_login_code_generation,
     log_login_locked,
-    log_login_token_generation
+    log_login_token_generation,
+    log_refresh_tokens_purged,
+    log_expired_registrations_purged,
+    log_user_marked_unreliable
 )
 import services.localization as i18n
-from models.general import (LoginSchema, RefreshTokenWrapper, UserBase, UserIn, User, UserOut, UserLanguage,
+from models.general import (LoginSchema, RefreshTokenWrapper, UserBase, UserIn, User, UserOut, UserLanguage, MailKind,
+    UserType, UserStatus, UserNearby, UserPage, Incident, Alert, AlertIn, AlertAccepted, AlertVoteIn, AlertVotes,
+    LocationIn, WhiteRecord,
     PasswordResetRequest, PasswordResetConfirm, 
     RefreshToken)
 from services.security import (
-    LOGIN_LOCK_HOURS, get_password_hash, check_password_against_hash, generate_random_token, get_token_hash, 
+    LOGIN_LOCK_HOURS, get_password_hash_async, check_password_against_hash_async, 
+    generate_random_token, get_token_hash, 
     generate_activation_token, activation_expiry, 
     now_tz_naive, from_timestamp_to_datetime_tz_naive, 
     generate_otp_code, otp_expiry, otp_hmac, otp_verify, get_email_hash, check_email_against_hash,
     RESET_LOCK_HOURS, MAIL_COOLDOWN_SECONDS,
-    create_access_token, create_refresh_token, decode_token, MAX_ACTIVE_REFRESH_TOKENS,
-    check_token_against_hash, create_login_token
-    )
-from core.dbmgr import get_session, get_engine
-from services.network import (
-    send_activation_mail, send_reset_code_mail, send_reset_successful_mail,
-    send_login_successful_mail, send_login_code_mail
+    create_access_token, create_refresh_token, decode_token, decode_token_cached, token_cache,
+    MAX_ACTIVE_REFRESH_TOKENS,
+    check_token_against_hash, create_login_token,
+    get_password_pool_stats, shutdown_password_executor
     )
+from core.dbmgr import get_async_session, get_async_engine, get_pool_stats
+from services.network import get_mail_pool, close_mail_pool
+from services.outbox import enqueue_mail, get_outbox_stats
+from services.maintenance import purge_refresh_tokens, purge_expired_registrations
+from services.geo import find_users_nearby
+from services.alerts import AlertBuffer
+from services.incidents import IncidentClusterer, get_surviving_incident
+from services.votes import add_vote, credibility
+from services.whitelist import WhitelistFilter, import_whitelist, iter_lines
+from services.users import get_users_page, export_users
+from services.push import HttpPushGateway, AlertFanOut
+from services.locations import LocationBuffer
+from services.realtime import Hub, AlertTail
 from core.exceptions import (
     token_expired_exception, token_not_valid_exception,
     credentials_exception, two_factor_locked_exception,
     two_factor_not_valid_exception, two_factor_required_response,
-    permission_exception
+    permission_exception, service_unavailable_exception, not_found_exception,
+    bad_request_exception
     )
 
 def init_settings():
     setup_logging()
 
+async def sweep_refresh_tokens():
+    async for db_session in get_async_session(app.state.db_engine):
+        counts = await purge_refresh_tokens(db_session, settings.maintenance_batch_size)
+        log_refresh_tokens_purged(counts)
+
+async def sweep_expired_registrations():
+    async for db_session in get_async_session(app.state.db_engine):
+        count = await purge_expired_registrations(db_session, settings.maintenance_batch_size)
+        log_expired_registrations_purged(count)
+
+async def write_metrics_snapshot():
+    await asyncio.to_thread(write_snapshot, settings.metrics_dir)
+
+# once per incident: the first alert only
+def push_first_alerts(alerts: list[dict]):
+    app.state.push_fanout.submit(incident_clusterer.first_alerts(alerts))
+
+def start_push_fanout():
+    if not settings.push_gateway_url:
+        return None
+    gateway = HttpPushGateway(settings.push_gateway_url, settings.push_gateway_token,
+        settings.push_max_in_flight, settings.push_timeout)
+    fanout = AlertFanOut(gateway, settings.push_queue_size, 
+        settings.push_max_in_flight, settings.push_batch_size)
+    alert_buffer.on_flush.append(push_first_alerts)
+    return fanout
+
+def start_background_tasks() -> list:
+    tasks = [
+        asyncio.create_task(alert_buffer.run(app.state.db_engine), name="alert_flusher"),
+        asyncio.create_task(location_buffer.run(app.state.db_engine), name="location_flusher")
+    ]
+    tasks.append(start_periodic_task("alert_tail", settings.stream_poll_seconds, 
+        lambda: alert_tail.poll(app.state.db_engine)))
+    if settings.whitelist_check_enabled:
+        tasks.append(start_periodic_task("whitelist_refresh", settings.whitelist_refresh_seconds,
+            lambda: whitelist_filter.refresh(app.state.db_engine), run_first=True))
+    if app.state.push_fanout is not None:
+        for i in range(settings.push_workers):
+            tasks.append(asyncio.create_task(app.state.push_fanout.run(app.state.db_engine), 
+                name=f"push_fanout_{i}"))
+    if settings.metrics_dir:
+        os.makedirs(settings.metrics_dir, exist_ok=True)
+        tasks.append(start_periodic_task("metrics_snapshot", 
+            settings.metrics_snapshot_seconds, write_metrics_snapshot))
+    if settings.refresh_token_sweep_seconds > 0:
+        tasks.append(start_periodic_task("refresh_token_sweeper", 
+            settings.refresh_token_sweep_seconds, sweep_refresh_tokens))
+    if settings.registration_sweep_seconds > 0:
+        tasks.append(start_periodic_task("registration_sweeper", 
+            settings.registration_sweep_seconds, sweep_expired_registrations))
+    return tasks
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Starting up api framework...")
     init_settings()
-    app.state.db_engine = get_engine(settings.db_url)
+    app.state.db_engine = get_async_engine(settings.db_url)
+    app.state.push_fanout = start_push_fanout()
+    app.state.tasks = start_background_tasks()
     yield
     print("Shutting down api framework...")
-    app.state.db_engine.dispose()
+    await stop_tasks(app.state.tasks)
+    await alert_buffer.flush(app.state.db_engine)
+    await location_buffer.flush(app.state.db_engine)
+    if app.state.push_fanout is not None:
+        alert_buffer.on_flush.remove(push_first_alerts)
+        await app.state.push_fanout.gateway.close()
+    if settings.metrics_dir:
+        remove_snapshot(settings.metrics_dir)
+    await app.state.db_engine.dispose()
     app.state.db_engine = None
+    shutdown_password_executor()
+    close_mail_pool()
+    stop_logging()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -79,16 +170,62 @@ app.add_middleware(CORSMiddleware,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["Authorization", "Content-Type"])
 
-def get_db_session():
+async def get_db_session():
     engine = app.state.db_engine
-    yield from get_session(engine)
+    async for session in get_async_session(engine):
+        yield session
+
+def to_uuid(value: str) -> uuid_pkg.UUID | None:
+    try:
+        return uuid_pkg.UUID(value)
+    except (ValueError, TypeError, AttributeError):
+        return None
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
+
+# authenticated users (UserOut fields only), by user id
+user_cache = TTLCache(settings.user_cache_max_entries, settings.user_cache_ttl_seconds)
+
+incident_clusterer = IncidentClusterer(settings.incident_radius_km,
+    settings.incident_window_seconds, settings.incident_max_seconds)
+alert_buffer = AlertBuffer(settings.alert_buffer_size, 
+    settings.alert_batch_size, settings.alert_flush_seconds, incident_clusterer)
+register_gauge("alert_buffer_depth", lambda: len(alert_buffer.rows))
+register_gauge("open_incidents", lambda: len(incident_clusterer.incidents))
+location_buffer = LocationBuffer(settings.location_buffer_size,
+    settings.location_batch_size, settings.location_flush_seconds)
+register_gauge("location_buffer_depth", lambda: len(location_buffer.positions))
+stream_hub = Hub(settings.stream_radius_km, settings.stream_queue_size)
+alert_tail = AlertTail(stream_hub, settings.alert_batch_size, gap_seconds=10,
+    incident_seconds=settings.incident_window_seconds)
+register_gauge("stream_connections", lambda: stream_hub.connections)
+whitelist_filter = WhitelistFilter(settings.whitelist_bloom_capacity,
+    settings.whitelist_bloom_error_rate, settings.whitelist_batch_size,
+    settings.whitelist_gap_seconds, settings.whitelist_rebuild_seconds)
+register_gauge("push_queue_depth", 
+    lambda: app.state.push_fanout.queue.qsize() if getattr(app.state, "push_fanout", None) else 0)
+
+ip_limiter = TokenBucketLimiter(settings.rate_limit_ip_per_minute, 
+    settings.rate_limit_ip_burst, settings.rate_limit_max_keys)
+account_limiter = TokenBucketLimiter(settings.rate_limit_account_per_minute, 
+    settings.rate_limit_account_burst, settings.rate_limit_max_keys)
+
+# to reject floods before they cost bcrypt work or db writes
+async def limit_by_client_ip(request: Request):
+    if settings.rate_limit_enabled:
+        peer_ip = request.client.host if request.client else None
+        check_rate_limit(ip_limiter, get_rate_limit_key(peer_ip,
+            request.headers.get("x-forwarded-for"), settings.rate_limit_trusted_proxies))
+
+def limit_by_account(email: str):
+    if settings.rate_limit_enabled:
+        check_rate_limit(account_limiter, get_email_hash(email))
 
 async def get_current_user(access_token: str = Depends(oauth2_scheme),
-                    db_session: Session = Depends(get_db_session)):
+                    db_session: AsyncSession = Depends(get_db_session)):
     try:
-        token_data = decode_token(access_token)
+        token_data = decode_token_cached(access_token)
     except ExpiredSignatureError:
         raise token_expired_exception() # we raise a specific error
     except InvalidTokenError:
@@ -104,16 +241,23 @@ async def get_current_user(access_token: str = Depends(oauth2_scheme),
     if (not user_id) or (not token_iat) or (not token_exp) or \
         (not token_type) or (token_type != "access"): 
             raise token_not_valid_exception() 
-    statement = select(User).where(User.id == user_id)
-    user = db_session.exec(statement).first()
-    if user is None:
+    user_uuid = to_uuid(user_id)
+    if user_uuid is None:
         raise token_not_valid_exception()
+    user = user_cache.get(user_uuid)
+    if user is None:
+        statement = select(User).where(User.id == user_uuid)
+        db_user = (await db_session.exec(statement)).first()
+        if db_user is None:
+            raise token_not_valid_exception()
+        user = UserOut.model_validate(db_user)
+        user_cache.set(user_uuid, user)
     token_iat_dt = from_timestamp_to_datetime_tz_naive(token_iat)   
     if token_iat_dt < user.last_reset_done_at:
         raise token_expired_exception()    
     return user
 
-def check_refresh_token(token_data: dict | None, db_session: Session):
+async def check_refresh_token(token_data: dict | None, db_session: AsyncSession):
     if token_data is None:
         raise InvalidTokenError
     user_id = token_data.get("sub")
@@ -126,21 +270,25 @@ def check_refresh_token(token_data: dict | None, db_session: Session):
         (not token_type) or (token_type != "refresh") or \
             (not token_jti) or (not token_raw_secret): 
         raise InvalidTokenError
-    statement = select(User).where(User.id == user_id)
-    user = db_session.exec(statement).first()
-    if user is None:
+    user_uuid = to_uuid(user_id)
+    token_uuid = to_uuid(token_jti)
+    if (user_uuid is None) or (token_uuid is None):
+        raise InvalidTokenError
+    # user and token with a single query (token columns are None if not found)
+    q = select(User.last_reset_done_at, RefreshToken.raw_hash, RefreshToken.is_revoked).outerjoin(
+        RefreshToken, (RefreshToken.id == token_uuid) & (RefreshToken.user_id == User.id)
+    ).where(User.id == user_uuid)
+    row = (await db_session.exec(q)).first()
+    if row is None:
         raise InvalidSubjectError
     token_iat_dt = from_timestamp_to_datetime_tz_naive(token_iat)
-    if token_iat_dt < user.last_reset_done_at:
+    if token_iat_dt < row.last_reset_done_at:
         raise InvalidIssuedAtError
-    q = select(RefreshToken).where(
-        (RefreshToken.id == token_jti) and (RefreshToken.user_id == user.id))
-    refresh_token = db_session.exec(q).first()
-    if (refresh_token is None) or (refresh_token.is_revoked):
+    if (row.raw_hash is None) or (row.is_revoked):
         raise ExpiredSignatureError
-    if not check_token_against_hash(token_raw_secret, refresh_token.raw_hash):
+    if not check_token_against_hash(token_raw_secret, row.raw_hash):
         raise InvalidJTIError
-    return (user, refresh_token) # user and db refresh token
+    return (user_uuid, token_uuid, row.raw_hash) # user id, token id and current token hash
 
 def check_login_token(token_data: dict | None, user: User):
     if token_data is None:
@@ -162,7 +310,7 @@ def check_login_token(token_data: dict | None, user: User):
 @app.post("/api/auth/refresh")
 async def refresh_auth_tokens(
             wrapper: RefreshTokenWrapper, 
-            db_session: Session = Depends(get_db_session)):
+            db_session: AsyncSession = Depends(get_db_session)):
     try:
         token_data = decode_token(wrapper.refresh_token)
     except ExpiredSignatureError:
@@ -171,8 +319,8 @@ async def refresh_auth_tokens(
         raise token_not_valid_exception()
     except:
         token_data = None
-    try: # check token validity (it returns user and database refresh token)
-        user, rtoken = check_refresh_token(token_data, db_session)
+    try: # check token validity (it returns user id, token id and token hash)
+        user_id, token_id, raw_hash = await check_refresh_token(token_data, db_session)
     except InvalidIssuedAtError or ExpiredSignatureError:
         raise token_expired_exception()
     except:
@@ -180,16 +328,37 @@ async def refresh_auth_tokens(
     now = now_tz_naive()
     new_raw_secret = generate_random_token()
     new_raw_secret_hash = get_token_hash(new_raw_secret)
-    rtoken.raw_hash = new_raw_secret_hash
-    rtoken.ip_address=get_client_ip()
-    rtoken.updated_at=now
-    user.last_refresh_at = now
-    db_session.add(user)
-    db_session.add(rtoken)
-    db_session.commit()
-    new_access_token = create_access_token(str(user.id))
+    # the update matches only if the token hasn't been rotated (or revoked) 
+    # in the meantime, so only one of concurrent refreshes wins
+    q = update(RefreshToken).where(
+        (RefreshToken.id == token_id) & 
+        (RefreshToken.raw_hash == raw_hash) & 
+        (col(RefreshToken.is_revoked) == False)
+    ).values(
+        raw_hash=new_raw_secret_hash,
+        ip_address=get_client_ip(),
+        updated_at=now
+    )
+    if db_session.bind.dialect.name == "postgresql":
+        # one statement: the user is updated by the rotation (a data-modifying CTE)
+        rotated = q.returning(RefreshToken.user_id).cte("rotated")
+        q = update(User).where(col(User.id).in_(select(rotated.c.user_id))).values(
+            last_refresh_at=now).returning(User.id).execution_options(synchronize_session=False)
+        if (await db_session.exec(q)).first() is None:
+            await db_session.rollback()
+            raise token_not_valid_exception()
+    else: # other databases (sqlite) don't have data-modifying CTEs
+        q = q.returning(RefreshToken.id).execution_options(synchronize_session=False)
+        if (await db_session.exec(q)).first() is None:
+            await db_session.rollback()
+            raise token_not_valid_exception()
+        q = update(User).where(User.id == user_id).values(
+            last_refresh_at=now).execution_options(synchronize_session=False)
+        await db_session.exec(q)
+    await db_session.commit()
+    new_access_token = create_access_token(str(user_id))
     new_refresh_token = create_refresh_token(
-        str(user.id), str(rtoken.id), 
+        str(user_id), str(token_id), 
         new_raw_secret, created_at=now)
     return {
         "access_token": new_access_token,
@@ -200,7 +369,7 @@ async def refresh_auth_tokens(
 @app.post("/api/auth/revoke")
 async def logout(
             wrapper: RefreshTokenWrapper,
-            db_session: Session = Depends(get_db_session)):
+            db_session: AsyncSession = Depends(get_db_session)):
     try:
         token_data = decode_token(wrapper.refresh_token)
     except ExpiredSignatureError:
@@ -209,15 +378,17 @@ async def logout(
         raise token_not_valid_exception()
     except:
         token_data = None
-    try: # check token validity (it returns user and database refresh token)
-        _, rtoken = check_refresh_token(token_data, db_session)
+    try: # check token validity (it returns user id, token id and token hash)
+        _, token_id, raw_hash = await check_refresh_token(token_data, db_session)
     except InvalidIssuedAtError or ExpiredSignatureError:
         raise token_expired_exception()
     except:
         raise token_not_valid_exception()
-    rtoken.is_revoked = True
-    db_session.add(rtoken)
-    db_session.commit()    
+    q = update(RefreshToken).where(
+        (RefreshToken.id == token_id) & (RefreshToken.raw_hash == raw_hash)
+    ).values(is_revoked=True).execution_options(synchronize_session=False)
+    await db_session.exec(q)
+    await db_session.commit()    
     return {"detail": "Logout successful"}
 
 api_dirname = os.path.dirname(__file__)
@@ -235,16 +406,16 @@ async def get_terms(request: Request, response: Response):
         fpath += ".example"
     return FileResponse(fpath)
  
-@app.post("/api/auth/login")
+@app.post("/api/auth/login", dependencies=[Depends(limit_by_client_ip)])
 async def login(data: LoginSchema,
-            background_tasks: BackgroundTasks,
-            db_session: Session = Depends(get_db_session)):
+            db_session: AsyncSession = Depends(get_db_session)):
+    limit_by_account(data.email)
     now = now_tz_naive()
     new_login_token = None
     q = select(User).where(User.email == data.email)
-    user = db_session.exec(q).first()
+    user = (await db_session.exec(q)).first()
     if ((not user) or (not user.is_active) or 
-            (not check_password_against_hash(data.password, user.password_hash))):
+            (not await check_password_against_hash_async(data.password, user.password_hash))):
         raise credentials_exception()
     # if the 2FA code is present, we must verify it to generate a login token
     if data.login_code:
@@ -263,7 +434,7 @@ async def login(data: LoginSchema,
                 user.login_2fa_attempts = 0
                 log_login_locked(str(user.id))
             db_session.add(user)
-            db_session.commit()
+            await db_session.commit()
             raise two_factor_not_valid_exception()
         new_login_token = create_login_token(str(user.id))
         user.login_code_hash = None
@@ -306,15 +477,16 @@ async def login(data: LoginSchema,
         if code:
             user.last_login_mail_code_at = now
             db_session.add(user)
-            db_session.commit()
-            background_tasks.add_task(send_login_code_mail, user.email, code, user.language)
+            enqueue_mail(db_session, MailKind.login_code, user.email, user.language, code)
+            await db_session.commit()
         return two_factor_required_response()
-    q = select(RefreshToken).where(RefreshToken.user_id == user.id).order_by(desc(RefreshToken.updated_at))
-    active_tokens = db_session.exec(q).all()
-    if len(active_tokens) >= MAX_ACTIVE_REFRESH_TOKENS:
-        oldest_token = active_tokens[-1]
-        db_session.delete(oldest_token)
-        db_session.flush()
+    # we keep the newest tokens only, leaving room for the new one
+    newest = select(RefreshToken.id).where(RefreshToken.user_id == user.id).order_by(
+        desc(RefreshToken.updated_at)).limit(MAX_ACTIVE_REFRESH_TOKENS - 1)
+    q = delete(RefreshToken).where(
+        (RefreshToken.user_id == user.id) & (col(RefreshToken.id).not_in(newest))
+    ).execution_options(synchronize_session=False)
+    await db_session.exec(q)
     refresh_token_id = uuid_pkg.uuid4()
     raw_random_str = generate_random_token()
     raw_str_hash = get_token_hash(raw_random_str)
@@ -333,79 +505,370 @@ async def login(data: LoginSchema,
         ((now - user.last_login_mail_confirmation_at).total_seconds() > MAIL_COOLDOWN_SECONDS)) 
     if can_send:
         user.last_login_mail_confirmation_at = now
+        enqueue_mail(db_session, MailKind.login_successful, user.email, user.language)
     db_session.add(refresh_token)
     db_session.add(user)
-    db_session.commit()
+    await db_session.commit()
     atoken = create_access_token(str(user.id))
     rtoken = create_refresh_token(
         str(user.id), str(refresh_token_id), 
         raw_random_str, created_at=now)
     log_login_successful(str(user.id))
-    if can_send:
-        background_tasks.add_task(send_login_successful_mail, user.email, user.language)
     return {"access_token": atoken, "refresh_token": rtoken, "login_token": new_login_token, "token_type": "bearer"}
 
 @app.get("/api/user/profile", response_model=UserOut | None, status_code=status.HTTP_200_OK)
-async def get_profile(current_user: User = Depends(get_current_user)):
+async def get_profile(current_user: UserOut = Depends(get_current_user)):
     return current_user
 
+@app.put("/api/user/profile/location", status_code=status.HTTP_202_ACCEPTED)
+async def update_location(location: LocationIn, current_user: UserOut = Depends(get_current_user)):
+    if not location_buffer.update(current_user.id, location.gps_lat, location.gps_lon, now_tz_naive()):
+        raise service_unavailable_exception(retry_after=max(1, round(settings.location_flush_seconds)))
+    stream_hub.move_user(current_user.id, location.gps_lat, location.gps_lon)
+    return {"message": "Location updated"}
+
 @app.get("/api/user/{user_id}", response_model=UserOut | None, status_code=status.HTTP_200_OK)
 async def get_user(user_id: str, 
-                current_user: User = Depends(get_current_user),
-                db_session: Session = Depends(get_db_session)):
+                current_user: UserOut = Depends(get_current_user),
+                db_session: AsyncSession = Depends(get_db_session)):
     if not current_user.is_admin:
         raise permission_exception()
-    user = db_session.exec(select(User).where(User.id == user_id)).first()
+    user_uuid = to_uuid(user_id)
+    if user_uuid is None:
+        return None
+    user = (await db_session.exec(select(User).where(User.id == user_uuid))).first()
     return user
 
+@app.post("/api/alerts", response_model=AlertAccepted, status_code=status.HTTP_202_ACCEPTED)
+async def create_alert(alert_in: AlertIn, current_user: UserOut = Depends(get_current_user)):
+    if current_user.status == UserStatus.blocked:
+        raise permission_exception()
+    ref = uuid_pkg.uuid4()
+    row = {
+        "ref": ref,
+        "user_id": current_user.id,
+        "description": alert_in.description,
+        "severity": alert_in.severity,
+        "gps_lat": alert_in.gps_lat,
+        "gps_lon": alert_in.gps_lon,
+        "created_at": now_tz_naive(),
+        "is_closed": False
+    }
+    if not alert_buffer.add(row):
+        raise service_unavailable_exception(retry_after=max(1, round(settings.alert_flush_seconds)))
+    return {"ref": ref, "incident_id": row.get("incident_id")}
+
+@app.get("/api/incidents/{incident_id}", response_model=Incident, status_code=status.HTTP_200_OK)
+async def get_incident(incident_id: str,
+                current_user: UserOut = Depends(get_current_user),
+                db_session: AsyncSession = Depends(get_db_session)):
+    if not (current_user.is_admin or current_user.is_official):
+        raise permission_exception()
+    incident_uuid = to_uuid(incident_id)
+    if incident_uuid is None:
+        raise not_found_exception()
+    # the id given when the alert was accepted can be an incident merged meanwhile
+    incident = await get_surviving_incident(db_session, incident_uuid)
+    if incident is None:
+        raise not_found_exception()
+    return incident
+
+# Users confirm (or deny) the alerts of the others: one vote per user and alert
+@app.post("/api/alerts/{ref}/votes", response_model=AlertVotes, status_code=status.HTTP_200_OK)
+async def vote_alert(ref: str, vote: AlertVoteIn,
+                current_user: UserOut = Depends(get_current_user),
+                db_session: AsyncSession = Depends(get_db_session)):
+    if current_user.status != UserStatus.ok:
+        raise permission_exception()
+    alert_ref = to_uuid(ref)
+    if alert_ref is None:
+        raise not_found_exception()
+    alert = (await db_session.exec(select(Alert.id, Alert.user_id).where(Alert.ref == alert_ref))).first()
+    if alert is None: # unknown, or still buffered
+        raise not_found_exception()
+    if alert.user_id == current_user.id:
+        raise permission_exception()
+    votes_up, votes_down, counted, marked = await add_vote(db_session, alert.id, alert.user_id,
+        current_user.id, vote.is_valid)
+    await db_session.commit()
+    if marked:
+        user_cache.invalidate(alert.user_id)
+        log_user_marked_unreliable(str(alert.user_id))
+    return {"ref": alert_ref, "votes_up": votes_up, "votes_down": votes_down,
+        "credibility": credibility(votes_up, votes_down), "counted": counted}
+
+# the latest known position: a pending update, else the stored one
+async def get_user_position(user_id: uuid_pkg.UUID, db_session: AsyncSession) -> tuple:
+    pending = location_buffer.positions.get(user_id)
+    if pending is not None:
+        return pending[0], pending[1]
+    q = select(User.gps_lat, User.gps_lon).where(User.id == user_id)
+    return (await db_session.exec(q)).first() or (None, None)
+
+# Stream authorization: the access token can be a query parameter (browsers and most websocket 
+# clients can't send headers), the db session is closed before streaming.
+# It returns the user id and position, to subscribe.
+async def authorize_stream(access_token: str | None) -> tuple:
+    if access_token is None:
+        raise credentials_exception()
+    if stream_hub.connections >= settings.stream_max_connections:
+        raise service_unavailable_exception(retry_after=30)
+    # a rejected client doesn't keep the session (and its pool connection) open
+    async with aclosing(get_async_session(app.state.db_engine)) as sessions:
+        async for db_session in sessions:
+            current_user = await get_current_user(access_token, db_session)
+            if current_user.status == UserStatus.blocked:
+                raise permission_exception()
+            lat, lon = await get_user_position(current_user.id, db_session)
+    return current_user.id, lat, lon
+
+@app.websocket("/api/stream/ws")
+async def stream_websocket(websocket: WebSocket, token: str | None = None):
+    try:
+        user_id, lat, lon = await authorize_stream(token)
+    except HTTPException as e:
+        code = 1013 if e.status_code == status.HTTP_503_SERVICE_UNAVAILABLE else 1008
+        await websocket.close(code=code, reason=e.detail)
+        return
+    await websocket.accept()
+    subscriber = stream_hub.subscribe(user_id, lat, lon)
+
+    async def send_messages():
+        while True:
+            for message in await subscriber.get_all():
+                await websocket.send_json(message)
+
+    # clients can send their position: {"gps_lat": .., "gps_lon": ..}
+    async def receive_positions():
+        try:
+            while True:
+                try:
+                    location = LocationIn.model_validate(await websocket.receive_json())
+                except ValueError:
+                    continue
+                stream_hub.move(subscriber, location.gps_lat, location.gps_lon)
+        except WebSocketDisconnect:
+            pass
+
+    # the connection ends when the client disconnects or when a send fails
+    sender = asyncio.create_task(send_messages())
+    receiver = asyncio.create_task(receive_positions())
+    try:
+        done, _ = await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
+        stream_hub.unsubscribe(subscriber)
+    if sender in done:
+        try:
+            await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        except Exception:
+            pass # already closed by the client
+
+# The fallback for clients without websockets (a text/event-stream response)
+@app.get("/api/stream/sse")
+async def stream_events(token: str | None = None, 
+                access_token: str | None = Depends(optional_oauth2_scheme)):
+    user_id, lat, lon = await authorize_stream(access_token or token)
+
+    # we subscribe in the generator: its "finally" runs only if it starts
+    async def events():
+        subscriber = stream_hub.subscribe(user_id, lat, lon)
+        try:
+            while True:
+                try:
+                    messages = await asyncio.wait_for(subscriber.get_all(), 
+                        timeout=settings.stream_heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                for message in messages:
+                    yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+        finally:
+            stream_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", 
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/users/nearby", response_model=list[UserNearby], status_code=status.HTTP_200_OK)
+async def get_users_nearby(
+                lat: float = Query(ge=-90, le=90), 
+                lon: float = Query(ge=-180, le=180),
+                radius_km: float = Query(gt=0, le=settings.nearby_max_radius_km),
+                type: UserType | None = None,
+                is_active: bool | None = True,
+                limit: int = Query(default=100, ge=1, le=settings.nearby_max_results),
+                current_user: UserOut = Depends(get_current_user),
+                db_session: AsyncSession = Depends(get_db_session)):
+    if not current_user.is_admin:
+        raise permission_exception()
+    found = await find_users_nearby(db_session, lat, lon, radius_km, 
+        user_type=type.value if type else None, is_active=is_active, limit=limit)
+    return [UserNearby(**user.model_dump(), distance_km=round(distance, 3)) for user, distance in found]
+
+@app.get("/api/users", response_model=UserPage, status_code=status.HTTP_200_OK)
+async def get_users(
+                cursor: str | None = None, # next_cursor of the previous page
+                limit: int = Query(default=100, ge=1, le=settings.users_page_max_size),
+                type: UserType | None = None,
+                status: UserStatus | None = None,
+                is_active: bool | None = None,
+                current_user: UserOut = Depends(get_current_user),
+                db_session: AsyncSession = Depends(get_db_session)):
+    if not current_user.is_admin:
+        raise permission_exception()
+    try:
+        users, next_cursor = await get_users_page(db_session, cursor, limit, 
+            user_type=type.value if type else None, status=status.value if status else None, 
+            is_active=is_active)
+    except ValueError as e:
+        raise bad_request_exception(str(e))
+    return {"users": users, "next_cursor": next_cursor}
+
+@app.get("/api/users/export")
+async def export_users_file(
+                format: str = Query(default="csv", pattern="^(csv|ndjson)$"),
+                type: UserType | None = None,
+                status: UserStatus | None = None,
+                is_active: bool | None = None,
+                current_user: UserOut = Depends(get_current_user)):
+    if not current_user.is_admin:
+        raise permission_exception()
+    rows = export_users(app.state.db_engine, format, settings.users_export_chunk_size,
+        user_type=type.value if type else None, status=status.value if status else None,
+        is_active=is_active)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(rows, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="users.{format}"'})
+
+# CSV file with the header "email,firstname,surname,type" (only email is mandatory):
+# records with an already whitelisted email are updated
+@app.post("/api/whitelist/import", status_code=status.HTTP_200_OK)
+async def import_whitelist_file(file: UploadFile,
+                current_user: UserOut = Depends(get_current_user),
+                db_session: AsyncSession = Depends(get_db_session)):
+    if not current_user.is_admin:
+        raise permission_exception()
+    try:
+        return await import_whitelist(db_session, iter_lines(file.read), 
+            settings.whitelist_batch_size, whitelist_filter)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise bad_request_exception(str(e))
+
+@app.get("/api/admin/stats")
+async def get_stats(current_user: UserOut = Depends(get_current_user),
+                db_session: AsyncSession = Depends(get_db_session)):
+    if not current_user.is_admin:
+        raise permission_exception()
+    return {
+        "password_hash_pool": get_password_pool_stats(),
+        "user_cache": user_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "rate_limit": {
+            "ip": ip_limiter.stats(),
+            "account": account_limiter.stats()
+        },
+        "db_pool": get_pool_stats(app.state.db_engine),
+        "mail_pool": get_mail_pool().stats(),
+        "mail_outbox": await get_outbox_stats(db_session),
+        "logging": get_logging_stats(),
+        "alert_buffer": alert_buffer.stats(),
+        "incidents": incident_clusterer.stats(),
+        "location_buffer": location_buffer.stats(),
+        "whitelist": whitelist_filter.stats(),
+        "stream": stream_hub.stats(),
+        "push": app.state.push_fanout.stats() if app.state.push_fanout else None
+    }
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def get_metrics(request: Request, 
+                access_token: str | None = Depends(optional_oauth2_scheme),
+                db_session: AsyncSession = Depends(get_db_session)):
+    # the direct peer: X-Forwarded-For is written by clients
+    peer_ip = request.client.host if request.client else None
+    if peer_ip not in settings.metrics_allowed_ips:
+        if access_token is None:
+            raise credentials_exception()
+        current_user = await get_current_user(access_token, db_session)
+        if not current_user.is_admin:
+            raise permission_exception()
+    if settings.metrics_dir:
+        await write_metrics_snapshot() # this worker's numbers are always fresh
+        snapshots = await asyncio.to_thread(read_snapshots, settings.metrics_dir)
+        metrics = merge_snapshots(snapshots)
+    else:
+        metrics = collect()
+    # the outbox is shared by all workers, so it's read once here
+    for mail_status, count in (await get_outbox_stats(db_session)).items():
+        mail_status = getattr(mail_status, "value", mail_status)
+        metrics["gauges"].append(["mail_outbox_mails", [["status", mail_status]], count])
+    return PlainTextResponse(render_prometheus(metrics), 
+        media_type="text/plain; version=0.0.4")
+
 @app.delete("/api/user/{user_id}")
-def delete_user(user_id: str, 
-                current_user: User = Depends(get_current_user), 
-                db_session: Session = Depends(get_db_session)):
+async def delete_user(user_id: str, 
+                current_user: UserOut = Depends(get_current_user), 
+                db_session: AsyncSession = Depends(get_db_session)):
     if not current_user.is_admin:
         raise permission_exception()
-    user = db_session.exec(select(User).where(User.id == user_id)).first()
+    user_uuid = to_uuid(user_id)
+    if user_uuid is None:
+        return {"message": "User not found"}
+    user = (await db_session.exec(select(User).where(User.id == user_uuid))).first()
     if user:
-        db_session.delete(user)
-        db_session.commit()
+        await db_session.delete(user)
+        await db_session.commit()
+        user_cache.invalidate(user_uuid)
         return {"message": "User deleted"}
     return {"message": "User not found"}
 
 @app.put("/api/user/{user_id}", response_model=UserOut | None, status_code=status.HTTP_200_OK)
-def update_user(user_id: str, user_new: UserBase, 
-                current_user: User = Depends(get_current_user), 
-                db_session: Session = Depends(get_db_session)):
+async def update_user(user_id: str, user_new: UserBase, 
+                current_user: UserOut = Depends(get_current_user), 
+                db_session: AsyncSession = Depends(get_db_session)):
     if not current_user.is_admin:
         raise permission_exception()
-    user = db_session.exec(select(User).where(User.id == user_id)).first()
+    user_uuid = to_uuid(user_id)
+    if user_uuid is None:
+        return {"message": "User not found"}
+    user = (await db_session.exec(select(User).where(User.id == user_uuid))).first()
     if user:
         user.firstname = user_new.firstname
         user.surname = user_new.surname
         db_session.add(user)
-        db_session.commit()
-        db_session.refresh(user)
+        await db_session.commit()
+        user_cache.invalidate(user_uuid)
+        await db_session.refresh(user)
         return user
     return {"message": "User not found"}
 
-@app.post("/api/register")
-def register_user(user_in: UserIn, background_tasks: BackgroundTasks, db_session: Session = Depends(get_db_session)):
+@app.post("/api/register", dependencies=[Depends(limit_by_client_ip)])
+async def register_user(user_in: UserIn, db_session: AsyncSession = Depends(get_db_session)):
+    limit_by_account(user_in.email)
     # We will return a unique registration message for almost all cases, for security
     reg_message = "If email address is valid, you will receive an activation mail message"
     is_an_admin = False
+    user_type = UserType.citizen
     # If database is empty and password is correct we insert the admin
-    if db_session.exec(select(User).limit(1)).first() is None:
+    if (await db_session.exec(select(User).limit(1))).first() is None:
         if (user_in.password == settings.admin_pass):
             is_an_admin = True
-    else: # else we check the email address existence in a whitelist
-        pass
-        # todo: if user_in.email is not in whitelist: 
-        # return message
-    existing_user = db_session.exec(
+    elif settings.whitelist_check_enabled: # else we check the email address existence in a whitelist
+        email_hash = get_email_hash(user_in.email)
+        if not whitelist_filter.might_contain(email_hash):
+            return { "message": reg_message }
+        white_record = (await db_session.exec(
+            select(WhiteRecord.type).where(WhiteRecord.email_hash == email_hash))).first()
+        if white_record is None:
+            return { "message": reg_message }
+        user_type = white_record
+    existing_user = (await db_session.exec(
         select(User).where(User.email == user_in.email)
-    ).first()
+    )).first()
     if existing_user and existing_user.is_active:
         return { "message": reg_message }
-    password_hashed = get_password_hash(user_in.password)
+    password_hashed = await get_password_hash_async(user_in.password)
     act_token = generate_activation_token()
     act_expires_at = activation_expiry()
     now = now_tz_naive()
@@ -413,8 +876,8 @@ def register_user(user_in: UserIn, background_tasks: BackgroundTasks, db_session
     if (existing_user and (not existing_user.is_active)):
         if (existing_user.activation_expires_at and 
             (existing_user.activation_expires_at < now)):
-                db_session.delete(existing_user)
-                db_session.flush()
+                await db_session.delete(existing_user)
+                await db_session.flush()
                 log_deleted_user = True
         else:
             return { "message": reg_message }
@@ -425,23 +888,24 @@ def register_user(user_in: UserIn, background_tasks: BackgroundTasks, db_session
         email_hash=get_email_hash(user_in.email),
         language=user_in.language,
         password_hash=password_hashed,
+        type=user_type,
         is_admin = is_an_admin,
         is_active=False,
         activation_code=act_token,
         activation_expires_at=act_expires_at
     )
     db_session.add(user)
-    db_session.commit()
+    enqueue_mail(db_session, MailKind.activation, user.email, user.language, act_token)
+    await db_session.commit()
     if log_deleted_user:
         log_deleted_user_to_renew_registration(user.email)
-    background_tasks.add_task(send_activation_mail, user.email, act_token, user.language)
     return { "message": reg_message }
 
 @app.get("/api/activate", response_class=HTMLResponse)
-def activate_user(request: Request, email: str, token: str, db_session: Session = Depends(get_db_session)):
+async def activate_user(request: Request, email: str, token: str, db_session: AsyncSession = Depends(get_db_session)):
     now = now_tz_naive()
-    user = db_session.exec(
-        select(User).where(User.email == email)).first()
+    user = (await db_session.exec(
+        select(User).where(User.email == email))).first()
     if not user:
         language = UserLanguage.en
         style_class="error"
@@ -469,7 +933,7 @@ def activate_user(request: Request, email: str, token: str, db_session: Session
         message=i18n.langmap[user.language]["act_done"]
         user.is_active = True
         db_session.add(user)
-        db_session.commit()
+        await db_session.commit()
 
     return templates.TemplateResponse(
         "activation_result.html",
@@ -484,11 +948,12 @@ def activate_user(request: Request, email: str, token: str, db_session: Session
         },
     )
 
-@app.post("/api/password-reset/request")
-def request_password_reset(data: PasswordResetRequest, background_tasks: BackgroundTasks, db_session: Session = Depends(get_db_session)):
+@app.post("/api/password-reset/request", dependencies=[Depends(limit_by_client_ip)])
+async def request_password_reset(data: PasswordResetRequest, db_session: AsyncSession = Depends(get_db_session)):
+    limit_by_account(data.email)
     if_mail_exists_str = "If email exists, you will receive a mail verification code"
-    user = db_session.exec(
-        select(User).where(User.email == data.email)).first()
+    user = (await db_session.exec(
+        select(User).where(User.email == data.email))).first()
     if (not user) or (not user.is_active):
         return {"message": if_mail_exists_str }
     now = now_tz_naive()
@@ -507,15 +972,16 @@ def request_password_reset(data: PasswordResetRequest, background_tasks: Backgro
     if code:
         user.last_reset_mail_code_at = now
         db_session.add(user)
-        db_session.commit()   
-        background_tasks.add_task(send_reset_code_mail, user.email, code, user.language)
+        enqueue_mail(db_session, MailKind.reset_code, user.email, user.language, code)
+        await db_session.commit()
     
     return {"message": if_mail_exists_str}
 
-@app.post("/api/password-reset/confirm")
-def confirm_password_reset(data: PasswordResetConfirm, background_tasks: BackgroundTasks, db_session: Session = Depends(get_db_session)):
-    user = db_session.exec(
-        select(User).where(User.email == data.email)).first()
+@app.post("/api/password-reset/confirm", dependencies=[Depends(limit_by_client_ip)])
+async def confirm_password_reset(data: PasswordResetConfirm, db_session: AsyncSession = Depends(get_db_session)):
+    limit_by_account(data.email)
+    user = (await db_session.exec(
+        select(User).where(User.email == data.email))).first()
     if (not user) or (not user.is_active):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -543,13 +1009,13 @@ def confirm_password_reset(data: PasswordResetConfirm, background_tasks: Backgro
             user.reset_attempts = 0
             log_password_reset_locked(str(user.id))
         db_session.add(user)
-        db_session.commit()
+        await db_session.commit()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Code or email not valid",
         )
     
-    hashedpass = get_password_hash(data.new_password)
+    hashedpass = await get_password_hash_async(data.new_password)
     user.password_hash = hashedpass
     user.reset_code_hash = None
     user.reset_expires_at = None
@@ -561,10 +1027,10 @@ def confirm_password_reset(data: PasswordResetConfirm, background_tasks: Backgro
         ((now - user.last_reset_mail_confirmation_at).total_seconds() > MAIL_COOLDOWN_SECONDS)) 
     if can_send:
         user.last_reset_mail_confirmation_at = now
+        enqueue_mail(db_session, MailKind.reset_successful, user.email, user.language)
     db_session.add(user)
-    db_session.commit()
+    await db_session.commit()
+    user_cache.invalidate(user.id)
     log_password_reset_successful(str(user.id))
-    if can_send:
-        background_tasks.add_task(send_reset_successful_mail, user.email, user.language)
 
     return {"message": "Password reset successful"}
@@ -0,0 +1,205 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+# Throughput and latency of the auth endpoints (login, refresh_auth_tokens, get_profile,
+# register_user), measured in process against a scratch SQLite database and an SMTP sink.
+# The result is printed as JSON, to compare it across commits.
+# Run it from the "api_backend" folder:
+#   python -m benchmarks.auth_api --concurrency 16 --requests 2000
+#   python -m benchmarks.auth_api --scenarios login,get_profile --output result.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from benchmarks.smtp_sink import SMTPSink
+
+SCENARIOS = ("login", "refresh_auth_tokens", "get_profile", "register_user")
+PASSWORD = "Bench!Password1"
+
+# api settings are read when "core.settings" is imported, so we import the api after this
+def configure_environment(db_url: str, smtp_port: int):
+    os.environ["DB_URL"] = db_url
+    os.environ["SMTP_HOST"] = "127.0.0.1"
+    os.environ["SMTP_PORT"] = str(smtp_port)
+    os.environ["RATE_LIMIT_ENABLED"] = "no" # all the requests come from the same client
+    os.environ["REFRESH_TOKEN_SWEEP_SECONDS"] = "0"
+    os.environ["REGISTRATION_SWEEP_SECONDS"] = "0"
+    os.environ.setdefault("APP_LOG_LEVEL", "warning")
+    for name in ("ADMIN_PASS", "EMAIL_PEPPER", "OTP_PEPPER", "GLOBAL_PEPPER"):
+        os.environ.setdefault(name, "benchmark")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-key-with-enough-bytes")
+
+def create_users(count: int) -> list:
+    from datetime import timedelta
+    from sqlmodel import SQLModel, Session
+    from core.settings import settings
+    from core.dbmgr import get_engine
+    from models.general import User
+    from services.security import get_password_hash, get_email_hash, now_tz_naive
+    engine = get_engine(settings.db_url)
+    SQLModel.metadata.create_all(engine)
+    password_hash = get_password_hash(PASSWORD) # the same for everybody, bcrypt is slow
+    # login tokens issued in the same second would be older than the user
+    reset_done_at = now_tz_naive() - timedelta(minutes=1)
+    users = []
+    with Session(engine) as db_session:
+        for i in range(count):
+            email = f"bench{i}@example.com"
+            user = User(firstname="Bench", surname="User", email=email,
+                email_hash=get_email_hash(email), password_hash=password_hash,
+                is_active=True, last_reset_done_at=reset_done_at)
+            db_session.add(user)
+            users.append((str(user.id), email))
+        db_session.commit()
+    engine.dispose()
+    return users
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+# "make_request(worker, i)" sends the i-th request from a worker and returns the response
+async def drive(concurrency: int, requests: int, make_request) -> dict:
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker(worker_index: int):
+        nonlocal errors, next_index
+        while next_index < requests:
+            i = next_index
+            next_index += 1
+            start = time.perf_counter()
+            response = await make_request(worker_index, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(requests / seconds, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2)
+    }
+
+async def login(client, user_id: str, email: str) -> dict:
+    from services.security import create_login_token
+    # a valid login token skips the 2FA code
+    data = {"email": email, "password": PASSWORD, "login_token": create_login_token(user_id)}
+    response = await client.post("/api/auth/login", json=data)
+    response.raise_for_status()
+    return response.json()
+
+async def run_scenario(name: str, client, users: list, concurrency: int, requests: int) -> dict:
+    from services.security import create_login_token
+    if name == "login":
+        login_tokens = [create_login_token(user_id) for user_id, _ in users]
+
+        async def make_request(w, i):
+            email = users[i % len(users)][1]
+            return await client.post("/api/auth/login", json={"email": email,
+                "password": PASSWORD, "login_token": login_tokens[i % len(users)]})
+
+    elif name == "refresh_auth_tokens":
+        # every worker rotates its own refresh token chain
+        chains = [(await login(client, *users[w % len(users)]))["refresh_token"] for w in range(concurrency)]
+
+        async def make_request(w, i):
+            response = await client.post("/api/auth/refresh", json={"refresh_token": chains[w]})
+            if response.status_code == 200:
+                chains[w] = response.json()["refresh_token"]
+            return response
+
+    elif name == "get_profile":
+        headers = []
+        for w in range(concurrency):
+            tokens = await login(client, *users[w % len(users)])
+            headers.append({"Authorization": f"Bearer {tokens['access_token']}"})
+
+        async def make_request(w, i):
+            return await client.get("/api/user/profile", headers=headers[w])
+
+    elif name == "register_user":
+        run_id = int(time.time())
+
+        async def make_request(w, i):
+            return await client.post("/api/register", json={"firstname": "Bench", "surname": "User",
+                "email": f"new{run_id}_{i}@example.com", "language": "en", "password": PASSWORD})
+
+    else:
+        raise ValueError(f"Unknown scenario '{name}'")
+    return await drive(concurrency, requests, make_request)
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def main(args):
+    sink = SMTPSink()
+    await sink.start()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_url = args.db_url or f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}"
+        configure_environment(db_url, sink.port)
+        import httpx
+        import api
+        import dispatcher
+        from core.settings import settings
+        users = create_users(args.users)
+        results = {}
+        transport = httpx.ASGITransport(app=api.app)
+        async with api.lifespan(api.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                for name in args.scenarios:
+                    results[name] = await run_scenario(name, client, users, args.concurrency, args.requests)
+        # the queued mails go to the sink, as the dispatcher does in production
+        start = time.perf_counter()
+        await asyncio.to_thread(dispatcher.run, settings.mail_dispatch_batch_size,
+            settings.mail_dispatch_concurrency, 0, True)
+        mail_seconds = time.perf_counter() - start
+    await sink.stop()
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "database": db_url.split(":", 1)[0],
+        "password_hash_executor": settings.password_hash_executor,
+        "password_hash_workers": settings.password_hash_workers,
+        "concurrency": args.concurrency,
+        "users": args.users,
+        "scenarios": results,
+        "mail_dispatch": {"sent": sink.messages, "seconds": round(mail_seconds, 3)}
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+if (__name__ ==  "__main__"):
+    parser = argparse.ArgumentParser(description="Auth api benchmark")
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=list(SCENARIOS),
+        help="comma separated list of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--db-url", default=None, help="a scratch database (default: a temporary SQLite file)")
+    parser.add_argument("--output", default=None, help="also write the JSON result to this file")
+    args = parser.parse_args()
+    asyncio.run(main(args))
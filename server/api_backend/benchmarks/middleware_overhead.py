@@ -0,0 +1,101 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+# Per-request overhead of RequestContextMiddleware, compared with the previous
+# BaseHTTPMiddleware implementation and with no middleware at all.
+# Run it from the "api_backend" folder:
+#   python -m benchmarks.middleware_overhead --requests 20000
+
+import argparse
+import asyncio
+import json
+import time
+from fastapi import FastAPI, Request
+from starlette.middleware.base import BaseHTTPMiddleware
+from middleware.request_ctx import (RequestContextMiddleware, 
+    request_id_ctx, client_ip_ctx, client_ua_ctx)
+
+# the previous implementation, kept here as the baseline
+class BaseHTTPRequestContextMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        rid = request.headers.get("x-request-id")
+        xff = request.headers.get("x-forwarded-for")
+        ua = request.headers.get("user-agent", "")
+        request_id_ctx.set(rid)
+        if xff:
+            client_ip = xff.split(",")[0].strip()
+        else:
+            client_ip = request.client.host if request.client else None
+        client_ip_ctx.set(client_ip)
+        client_ua_ctx.set(ua)
+        response = await call_next(request)
+        if rid:
+            response.headers["X-Request-ID"] = rid
+        return response
+
+def build_app(middleware_class):
+    app = FastAPI()
+    if middleware_class is not None:
+        app.add_middleware(middleware_class)
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/ping",
+    "raw_path": b"/ping",
+    "root_path": "",
+    "query_string": b"",
+    "headers": [(b"host", b"localhost"), (b"user-agent", b"bench"), (b"x-request-id", b"abc")],
+    "client": ("127.0.0.1", 50000),
+    "server": ("localhost", 8080)
+}
+
+async def call(app):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(dict(SCOPE), receive, send)
+
+async def measure(app, requests: int) -> float:
+    for _ in range(100): # warm up
+        await call(app)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call(app)
+    return (time.perf_counter() - start) / requests
+
+async def main(requests: int):
+    variants = {
+        "none": None,
+        "base_http_middleware": BaseHTTPRequestContextMiddleware,
+        "asgi_middleware": RequestContextMiddleware
+    }
+    per_request = {}
+    for name, middleware_class in variants.items():
+        per_request[name] = await measure(build_app(middleware_class), requests)
+    baseline = per_request["none"]
+    result = {
+        "requests": requests,
+        "per_request_us": {k: round(v * 1e6, 2) for k, v in per_request.items()},
+        "overhead_us": {k: round((v - baseline) * 1e6, 2) for k, v in per_request.items() if k != "none"}
+    }
+    print(json.dumps(result, indent=2))
+
+if (__name__ ==  "__main__"):
+    parser = argparse.ArgumentParser(description="RequestContextMiddleware overhead benchmark")
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
@@ -0,0 +1,131 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+# Nearby users lookup with the gps_cell index, compared with a bounding box query on
+# gps_lat/gps_lon (a full table scan), on a scratch SQLite database of random users.
+# Run it from the "api_backend" folder:
+#   python -m benchmarks.nearby_users --users 1000000 --queries 200
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import tempfile
+import time
+import uuid as uuid_pkg
+
+# a box around Italy
+LAT_RANGE = (36.6, 47.1)
+LON_RANGE = (6.6, 18.5)
+USER_TYPES = ("citizen", "fireman", "medic", "usar")
+
+def configure_environment(db_url: str):
+    os.environ["DB_URL"] = db_url
+    os.environ.setdefault("APP_LOG_LEVEL", "warning")
+    for name in ("ADMIN_PASS", "EMAIL_PEPPER", "OTP_PEPPER", "GLOBAL_PEPPER"):
+        os.environ.setdefault(name, "benchmark")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-key-with-enough-bytes")
+
+def create_users(db_url: str, count: int, chunk_size: int = 20000):
+    from sqlalchemy import insert
+    from sqlmodel import SQLModel
+    from core.dbmgr import get_engine
+    from models.general import User
+    from services.geo import cell_for
+    from services.security import now_tz_naive
+    engine = get_engine(db_url)
+    SQLModel.metadata.create_all(engine)
+    now = now_tz_naive()
+    rng = random.Random(1)
+    with engine.begin() as conn:
+        for first in range(0, count, chunk_size):
+            rows = []
+            for i in range(first, min(count, first + chunk_size)):
+                lat = rng.uniform(*LAT_RANGE)
+                lon = rng.uniform(*LON_RANGE)
+                rows.append({"id": uuid_pkg.uuid4(), "firstname": "Bench", "surname": "User",
+                    "email": f"bench{i}@example.com", "email_hash": f"hash{i}", "password_hash": "-",
+                    "language": "en", "is_admin": False, "is_official": False, "is_chief": False,
+                    "type": rng.choice(USER_TYPES), "status": "ok", "is_active": rng.random() < 0.9,
+                    "reset_attempts": 0, "login_2fa_attempts": 0, "last_reset_done_at": now, "created_at": now,
+                    "gps_lat": lat, "gps_lon": lon, "gps_cell": cell_for(lat, lon)})
+            conn.execute(insert(User), rows)
+    engine.dispose()
+
+# the same search without the grid index
+async def find_users_in_box(db_session, lat, lon, radius_km, user_type=None, is_active=True):
+    from sqlmodel import select, col
+    from models.general import User
+    from services.geo import haversine_km, KM_PER_DEGREE
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = radius_km / (KM_PER_DEGREE * math.cos(math.radians(min(89.9, abs(lat) + dlat))))
+    q = select(User).where(col(User.gps_lat).between(lat - dlat, lat + dlat) &
+        col(User.gps_lon).between(lon - dlon, lon + dlon))
+    if user_type is not None:
+        q = q.where(User.type == user_type)
+    if is_active is not None:
+        q = q.where(User.is_active == is_active)
+    users = (await db_session.exec(q)).all()
+    found = [(u, haversine_km(lat, lon, u.gps_lat, u.gps_lon)) for u in users]
+    return sorted((f for f in found if f[1] <= radius_km), key=lambda f: f[1])
+
+def summarize(latencies: list, results: list) -> dict:
+    latencies.sort()
+    return {
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "avg_results": round(sum(results) / len(results), 1)
+    }
+
+async def measure(engine, search, points, radius_km, user_type) -> dict:
+    from core.dbmgr import get_async_session
+    latencies = []
+    results = []
+    async for db_session in get_async_session(engine):
+        for lat, lon in points:
+            start = time.perf_counter()
+            found = await search(db_session, lat, lon, radius_km, user_type=user_type)
+            latencies.append(time.perf_counter() - start)
+            results.append(len(found))
+    return summarize(latencies, results)
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_url = f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}"
+        configure_environment(db_url)
+        from core.dbmgr import get_async_engine
+        from services.geo import find_users_nearby
+        start = time.perf_counter()
+        create_users(db_url, args.users)
+        setup_seconds = time.perf_counter() - start
+        rng = random.Random(2)
+        points = [(rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)) for _ in range(args.queries)]
+        engine = get_async_engine(db_url)
+        results = {}
+        for radius_km in args.radius_km:
+            for user_type in (None, "medic"):
+                name = f"{radius_km}km" + (f"_{user_type}" if user_type else "")
+                results[name] = {
+                    "gps_cell_index": await measure(engine, find_users_nearby, points, radius_km, user_type),
+                    "bounding_box_scan": await measure(engine, find_users_in_box, points[:args.scan_queries], radius_km, user_type)
+                }
+        await engine.dispose()
+    print(json.dumps({
+        "users": args.users,
+        "queries": args.queries,
+        "setup_seconds": round(setup_seconds, 1),
+        "results": results
+    }, indent=2))
+
+if (__name__ ==  "__main__"):
+    parser = argparse.ArgumentParser(description="Nearby users lookup benchmark")
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--scan-queries", type=int, default=10, help="the scan is slow, fewer queries")
+    parser.add_argument("--radius-km", type=lambda s: [float(r) for r in s.split(",")], default=[1.0, 5.0, 20.0])
+    args = parser.parse_args()
+    asyncio.run(main(args))
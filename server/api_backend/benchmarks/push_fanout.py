@@ -0,0 +1,91 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+# Time to the last delivery of one alert pushed to many recipients (100k by default),
+# from the recipients query to the last message received by a local push gateway
+# stand-in, on a scratch SQLite database. Run it from the "api_backend" folder:
+#   python -m benchmarks.push_fanout --recipients 100000 --max-in-flight 16 --latency 0.02
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import uuid as uuid_pkg
+from benchmarks.nearby_users import configure_environment
+from benchmarks.push_sink import PushSink
+
+CENTER = (45.07, 7.68)
+
+def create_recipients(db_url: str, count: int, radius_km: float, chunk_size: int = 20000):
+    from sqlalchemy import insert
+    from sqlmodel import SQLModel
+    from core.dbmgr import get_engine
+    from models.general import User
+    from services.geo import cell_for, KM_PER_DEGREE
+    from services.security import now_tz_naive
+    engine = get_engine(db_url)
+    SQLModel.metadata.create_all(engine)
+    now = now_tz_naive()
+    rng = random.Random(1)
+    # a square inscribed in the push circle, everybody is a recipient
+    half_side = radius_km / KM_PER_DEGREE / 2
+    with engine.begin() as conn:
+        for first in range(0, count, chunk_size):
+            rows = []
+            for i in range(first, min(count, first + chunk_size)):
+                lat = CENTER[0] + rng.uniform(-half_side, half_side)
+                lon = CENTER[1] + rng.uniform(-half_side, half_side)
+                rows.append({"id": uuid_pkg.uuid4(), "firstname": "Bench", "surname": "User",
+                    "email": f"bench{i}@example.com", "email_hash": f"hash{i}", "password_hash": "-",
+                    "language": "en", "is_admin": False, "is_official": False, "is_chief": False,
+                    "type": "citizen", "status": "ok", "is_active": True,
+                    "reset_attempts": 0, "login_2fa_attempts": 0, "last_reset_done_at": now, "created_at": now,
+                    "gps_lat": lat, "gps_lon": lon, "gps_cell": cell_for(lat, lon)})
+            conn.execute(insert(User), rows)
+    engine.dispose()
+
+async def main(args):
+    sink = PushSink(latency=args.latency)
+    await sink.start()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_url = f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}"
+        configure_environment(db_url)
+        os.environ["PUSH_OFFICIAL_RADIUS_KM"] = "0" # one pass
+        os.environ["PUSH_CHIEFS_RADIUS_KM"] = "0"
+        from core.settings import settings
+        from core.dbmgr import get_async_engine
+        from services.push import HttpPushGateway, fan_out_alert
+        create_recipients(db_url, args.recipients, settings.push_radius_km)
+        engine = get_async_engine(db_url)
+        gateway = HttpPushGateway(sink.url, "", args.max_in_flight, settings.push_timeout)
+        alert = {"ref": uuid_pkg.uuid4(), "user_id": uuid_pkg.uuid4(), "description": "benchmark",
+            "severity": 3, "gps_lat": CENTER[0], "gps_lon": CENTER[1]}
+        start = time.perf_counter()
+        counts = await fan_out_alert(engine, gateway, alert, args.max_in_flight, args.batch_size)
+        await gateway.close()
+        await engine.dispose()
+    await sink.stop()
+    print(json.dumps({
+        "recipients": args.recipients,
+        "batch_size": args.batch_size,
+        "max_in_flight": args.max_in_flight,
+        "gateway_latency_ms": args.latency * 1000,
+        "delivered": sink.messages,
+        "failed": counts["failed"],
+        "requests": sink.requests,
+        "time_to_last_delivery_s": round(sink.last_delivery_at - start, 3) if sink.last_delivery_at else None,
+        "messages_per_second": round(sink.messages / counts["seconds"], 1) if counts["seconds"] else None
+    }, indent=2))
+
+if (__name__ ==  "__main__"):
+    parser = argparse.ArgumentParser(description="Push fan-out benchmark")
+    parser.add_argument("--recipients", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=500, help="messages per gateway request")
+    parser.add_argument("--max-in-flight", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02, help="gateway answer time (seconds)")
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,79 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+# A local stand-in for the push gateway: it accepts {"messages": [...]} POST requests
+# (HTTP/1.1 keep-alive), counts the messages and answers 200 after "latency" seconds.
+# To run it alone (for example with PUSH_GATEWAY_URL=http://127.0.0.1:8099/push):
+#   python -m benchmarks.push_sink --port 8099
+
+import argparse
+import asyncio
+import json
+import time
+
+class PushSink:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.requests = 0
+        self.messages = 0
+        self.last_delivery_at = None # time.perf_counter() of the last message received
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/push"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value.strip())
+                body = await reader.readexactly(length) if length else b""
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                messages = json.loads(body).get("messages", []) if body else []
+                self.requests += 1
+                self.messages += len(messages)
+                self.last_delivery_at = time.perf_counter()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: 2\r\n\r\n{}")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def main(port: int, latency: float):
+    sink = PushSink(port=port, latency=latency)
+    await sink.start()
+    print(f"Push gateway stand-in on {sink.url}")
+    while True:
+        await asyncio.sleep(10)
+        print(f"requests={sink.requests} messages={sink.messages}")
+
+if (__name__ ==  "__main__"):
+    parser = argparse.ArgumentParser(description="Push gateway stand-in")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every answer")
+    args = parser.parse_args()
+    asyncio.run(main(args.port, args.latency))
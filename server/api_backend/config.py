@@ -7,15 +7,132 @@
 SERVER_NAME = "myservername" # the server name (publicly accessible, for example the reverse proxy)
 SERVER_PORT = 8080 # the server port (publicly accessible) 
 APP_LOG_LEVEL = 'warning' # 'info', 'warning'
+LOG_FORMAT = 'text' # 'text' or 'json' (one object per line, with the request extras)
+LOG_QUEUE_SIZE = 10000 # records waiting to be written, then new ones are dropped
 
 # The database connection URL and db engine logging
+# (the api uses the asyncio driver of the same database: asyncpg for postgresql, aiosqlite for sqlite)
 DB_URL = "postgresql://DB_USER:DB_PASS@DB_HOST:DB_PORT/quidalert_db"
 DB_ENGINE_LOG_ENABLED = "no"
 
+# Database connection pool (per server worker): every worker can open up to
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections, keep the total (see WORKERS)
+# below the postgres max_connections
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT = 30 # seconds to wait for a free connection
+DB_POOL_RECYCLE = 1800 # seconds, connections older than this are replaced
+DB_POOL_PRE_PING = True # test connections on checkout (survives db restarts)
+
 # Mail sender configuration
 SMTP_HOST = "mailserver" # to send activation mail messages to clients
 SMTP_PORT = 465
 SMTP_FROM = "no-reply@myservername"
+SMTP_POOL_SIZE = 2 # persistent connections to the relay (per server worker)
+SMTP_TIMEOUT = 30 # seconds
+SMTP_IDLE_SECONDS = 60 # idle connections older than this are reopened
+
+# Mail outbox dispatcher (dispatcher.py)
+MAIL_DISPATCH_BATCH_SIZE = 100 # mails claimed from the outbox at once
+MAIL_DISPATCH_CONCURRENCY = 2 # parallel smtp connections
+MAIL_DISPATCH_POLL_SECONDS = 2
+MAIL_CLAIM_SECONDS = 300 # claimed mails are retried after this time if the dispatcher crashes
+MAIL_MAX_ATTEMPTS = 8
+MAIL_RETRY_BASE_SECONDS = 30 # doubled at every failed attempt
+MAIL_RETRY_MAX_SECONDS = 3600
+MAIL_OUTBOX_RETENTION_HOURS = 24 # sent mails are deleted after this time
+
+# Periodic maintenance tasks of the api server (0 disables them, for example to
+# run them only once with maintenance.py and a scheduler instead of in every worker)
+REFRESH_TOKEN_SWEEP_SECONDS = 3600
+REGISTRATION_SWEEP_SECONDS = 3600 # expired registrations (never activated users)
+MAINTENANCE_BATCH_SIZE = 1000 # rows deleted per transaction
+
+# Password hashing pool (bcrypt runs outside the event loop)
+PASSWORD_HASH_EXECUTOR = "thread" # "thread" or "process"
+PASSWORD_HASH_WORKERS = 4 # max concurrent bcrypt computations per server worker
+
+# Authenticated user cache (per server worker): changes made by another worker
+# (password reset, user update/delete) are seen at most after the ttl
+USER_CACHE_TTL_SECONDS = 30
+USER_CACHE_MAX_ENTRIES = 10000
+
+# Rate limits of the expensive anonymous endpoints (login, registration, password reset),
+# per server worker: requests per minute after a burst, by client ip and by account (email)
+RATE_LIMIT_ENABLED = True # the limits below must be positive, set this to False to turn them off
+RATE_LIMIT_IP_PER_MINUTE = 30
+RATE_LIMIT_IP_BURST = 10
+RATE_LIMIT_ACCOUNT_PER_MINUTE = 5
+RATE_LIMIT_ACCOUNT_BURST = 5
+RATE_LIMIT_MAX_KEYS = 100000 # tracked ips/accounts (memory bound)
+# reverse proxies whose X-Forwarded-For hop is the client ip, else the direct peer is limited
+RATE_LIMIT_TRUSTED_PROXIES = []
+
+# Verified access tokens cache (per server worker), entries expire with the token
+TOKEN_CACHE_MAX_ENTRIES = 20000
+
+# Alerts submission (per server worker): alerts are buffered in memory and written in batches
+ALERT_BUFFER_SIZE = 50000 # alerts waiting to be written, then new ones are refused (503)
+ALERT_BATCH_SIZE = 500 # rows per INSERT
+ALERT_FLUSH_SECONDS = 0.5 # max time an alert waits in memory (lost if the worker crashes)
+
+# Incidents: alerts near in space and time are grouped, and notified once (services/incidents.py)
+INCIDENT_RADIUS_KM = 1 # max distance of an alert from the centroid of the incident
+INCIDENT_WINDOW_SECONDS = 900 # an incident without alerts for this time is closed
+INCIDENT_MAX_SECONDS = 21600 # older incidents get no more alerts, a new incident is opened
+
+# Registrations whitelist (the whitelist table): when enabled, only whitelisted emails can register
+WHITELIST_CHECK_ENABLED = False
+WHITELIST_REFRESH_SECONDS = 60 # how often the in-memory filter reads the new records
+WHITELIST_BLOOM_CAPACITY = 1000000 # records before the filter is rebuilt larger (about 1.2 MB per million)
+WHITELIST_BLOOM_ERROR_RATE = 0.01 # not whitelisted emails that still get a database lookup
+WHITELIST_BATCH_SIZE = 2000 # rows per upsert when importing, and per read when loading the filter
+WHITELIST_GAP_SECONDS = 600 # how long the filter looks for the ids of imports not yet committed
+WHITELIST_REBUILD_SECONDS = 86400 # the filter is read again completely (deleted records leave it)
+
+# Alert votes: credibility is (votes up + 1) / (votes + 2), from 0 to 1 (0.5 without votes)
+CREDIBILITY_MIN_VOTES = 10 # votes received by the alerts of a user before judging the user
+CREDIBILITY_UNRELIABLE = 0.3 # below this, the user becomes unreliable
+
+# Users positions (per server worker): the latest position of every user is kept in memory
+# and written in bulk (positions received in the last LOCATION_FLUSH_SECONDS are lost if the worker crashes)
+LOCATION_FLUSH_SECONDS = 5
+LOCATION_BATCH_SIZE = 1000 # users per UPDATE, a flush starts sooner when they are waiting
+LOCATION_BUFFER_SIZE = 100000 # users waiting to be written, then new ones are refused (503)
+
+# Push notifications of new alerts, through an http push gateway (disabled if the url is empty)
+PUSH_GATEWAY_URL = ""
+PUSH_RADIUS_KM = 5 # every active user within this distance
+PUSH_OFFICIAL_RADIUS_KM = 30 # officials (rescuers) within this distance
+PUSH_OFFICIAL_TYPES = [] # only officials of these user types (e.g. ["fireman", "medic"]), all if empty
+PUSH_CHIEFS_RADIUS_KM = 100 # chiefs (officials who coordinate) within this distance
+PUSH_BATCH_SIZE = 500 # messages per gateway request
+PUSH_MAX_IN_FLIGHT = 16 # concurrent gateway requests per alert
+PUSH_TIMEOUT = 10 # seconds
+PUSH_QUEUE_SIZE = 1000 # alerts waiting for the fan-out (per server worker), then they are not pushed
+PUSH_WORKERS = 2 # alerts pushed at the same time (per server worker)
+
+# Live alerts stream (websocket /api/stream/ws, or server-sent events /api/stream/sse), per server worker
+STREAM_RADIUS_KM = 5 # connected users within this distance receive the alert
+STREAM_QUEUE_SIZE = 100 # messages waiting for a slow client, then the oldest are dropped
+STREAM_MAX_CONNECTIONS = 20000
+STREAM_POLL_SECONDS = 1 # how often new alerts are read from the database
+STREAM_HEARTBEAT_SECONDS = 25 # server-sent events comment lines, to keep proxies from closing the stream
+
+# Nearby users search (/api/users/nearby)
+NEARBY_MAX_RADIUS_KM = 100
+NEARBY_MAX_RESULTS = 1000
+
+# Admin users listing (/api/users) and export (/api/users/export)
+USERS_PAGE_MAX_SIZE = 1000
+USERS_EXPORT_CHUNK_SIZE = 1000 # rows read at a time from the database cursor
+
+# Metrics (/api/metrics, prometheus text format)
+# scrapers allowed without an admin token, by direct peer address (not X-Forwarded-For):
+# never put the reverse proxy address here, or everybody could read the metrics
+METRICS_ALLOWED_IPS = []
+METRICS_DIR = "" # a writable directory shared by the server workers, needed if WORKERS > 1
+METRICS_SNAPSHOT_SECONDS = 10 # how often every worker writes its metrics in METRICS_DIR
 
 # A note about security configurations:
 # variables APP_MODE, ADMIN_PASS, OTP_PEPPER, EMAIL_PEPPER, GLOBAL_PEPPER, JWT_SECRET_KEY
@@ -2,13 +2,117 @@
 # Copyright (C) 2025  Davide Quirillo
 # Licensed under the GNU GPL v3 or later. See LICENSE for details.
 
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from core.settings import settings
+from core.metrics import get_histogram
+
+# asyncio driver used for each database backend named in DB_URL
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite"
+}
+
+# The pools measure how long a checkout waits for a free connection.
+# We use class attributes because the engine recreates its pool on dispose().
+class InstrumentedQueuePool(QueuePool):
+    wait_histogram = get_histogram("db_pool_wait_seconds", engine="sync")
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_histogram.observe(time.perf_counter() - start)
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    wait_histogram = get_histogram("db_pool_wait_seconds", engine="async")
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_histogram.observe(time.perf_counter() - start)
+
+def get_pool_options(url, poolclass) -> dict:
+    if (url.get_backend_name() == "sqlite") and (url.database in (None, "", ":memory:")):
+        return {} # in-memory sqlite uses its own single connection pool
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping
+    }
+
+# statement kinds measured separately, the others are counted as "other"
+QUERY_KINDS = ("select", "insert", "update", "delete")
+
+def on_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter() # one statement at a time per connection
+
+def on_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("query_start", None)
+    if start is None:
+        return
+    kind = statement.lstrip()[:6].lower()
+    if kind not in QUERY_KINDS:
+        kind = "other"
+    get_histogram("db_query_seconds", kind=kind).observe(time.perf_counter() - start)
+
+def instrument_queries(engine):
+    sync_engine = getattr(engine, "sync_engine", engine) # async engines wrap a sync one
+    event.listen(sync_engine, "before_cursor_execute", on_before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", on_after_cursor_execute)
 
 def get_engine(db_url):
-    engine = create_engine(db_url, echo=settings.db_engine_echo)
+    url = make_url(db_url)
+    engine = create_engine(url, echo=settings.db_engine_echo, 
+        **get_pool_options(url, InstrumentedQueuePool))
+    instrument_queries(engine)
     return engine
 
 def get_session(engine):
     with Session(engine) as session:
         yield session
+
+def get_async_db_url(db_url):
+    url = make_url(db_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver available for database '{backend}'")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+def get_async_engine(db_url):
+    url = get_async_db_url(db_url)
+    engine = create_async_engine(url, echo=settings.db_engine_echo, 
+        **get_pool_options(url, InstrumentedAsyncQueuePool))
+    instrument_queries(engine)
+    return engine
+
+async def get_async_session(engine):
+    # objects stay readable after commit, without lazy (blocking) reloads
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
+
+def get_pool_stats(engine) -> dict:
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"status": pool.status()}
+    stats = {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": settings.db_max_overflow
+    }
+    if isinstance(pool, (InstrumentedQueuePool, InstrumentedAsyncQueuePool)):
+        stats["wait_seconds"] = pool.wait_histogram.snapshot()
+    return stats
@@ -31,11 +31,33 @@ def two_factor_not_valid_exception():
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="2FA code not valid")
 
+def bad_request_exception(detail: str):
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=detail)
+
 def permission_exception():
     return HTTPException(
         status_code=status.HTTP_403_FORBIDDEN,
         detail="Permission denied")
 
+def not_found_exception():
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Not found")
+
+def too_many_requests_exception(retry_after: int):
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests",
+        headers={"Retry-After": str(retry_after)})
+
+def service_unavailable_exception(retry_after: int):
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Service temporarily unavailable",
+        headers={"Retry-After": str(retry_after)})
+
 def two_factor_required_response(): # Note: this is not an exception, but a response
     return Response(
         status_code=status.HTTP_401_UNAUTHORIZED,
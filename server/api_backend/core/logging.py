@@ -2,26 +2,81 @@
 # Copyright (C) 2025  Davide Quirillo
 # Licensed under the GNU GPL v3 or later. See LICENSE for details.
 
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import threading
 from core.settings import settings
+from core.metrics import get_counter, register_gauge
+
+EXTRA_FIELDS = ("client_ip", "request_id", "user_agent", "email_hash", "user_id")
+
+# attributes of every LogRecord (anything else comes from "extra")
+RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
 
 class DefaultExtrasFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
-        for k in ("client_ip", "request_id", "user_agent", "email_hash", "user_id"):
+        for k in EXTRA_FIELDS:
             if not hasattr(record, k):
                 setattr(record, k, "-")
         return True
 
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for k, v in record.__dict__.items():
+            if k not in RECORD_FIELDS:
+                data[k] = v
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+# The request path only puts records in a bounded queue (dropping them if it's full),
+# a background thread formats and writes them
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            _dropped_counter.inc()
+
+_dropped_counter = get_counter("log_records_dropped")
+_queue_handler: DroppingQueueHandler | None = None
+_listener: logging.handlers.QueueListener | None = None
+
 def setup_logging():
+    global _queue_handler, _listener
+    stop_logging()
     handler = logging.StreamHandler()
-    handler.addFilter(DefaultExtrasFilter())
-
-    formatter = logging.Formatter(
-        fmt="%(asctime)s %(levelname)s %(name)s "
-            "ip=%(client_ip)s req_id=%(request_id)s ua=%(user_agent)s email_hash=%(email_hash)s user_id=%(user_id)s %(message)s"
-    )
+    if settings.log_format.lower() == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            fmt="%(asctime)s %(levelname)s %(name)s "
+                "ip=%(client_ip)s req_id=%(request_id)s ua=%(user_agent)s email_hash=%(email_hash)s user_id=%(user_id)s %(message)s"
+        )
     handler.setFormatter(formatter)
 
+    log_queue = queue.Queue(maxsize=settings.log_queue_size)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _queue_handler.addFilter(DefaultExtrasFilter())
+    _listener = logging.handlers.QueueListener(log_queue, handler)
+    _listener.start()
+
     root = logging.getLogger()
     if settings.app_log_level.lower() == 'debug':
         root.setLevel(logging.DEBUG)
@@ -34,11 +89,42 @@ def setup_logging():
     else:
         root.setLevel(logging.INFO)
     root.handlers.clear()
-    root.addHandler(handler)
+    root.addHandler(_queue_handler)
+
+# It writes the queued records and stops the background thread: the next records
+# (the last ones of the shutdown) are written directly, nobody would read the queue
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        root = logging.getLogger()
+        if _queue_handler in root.handlers:
+            root.removeHandler(_queue_handler)
+            for handler in _listener.handlers:
+                handler.addFilter(DefaultExtrasFilter())
+                root.addHandler(handler)
+        _listener = None
+
+atexit.register(stop_logging)
+
+register_gauge("log_queue_depth", 
+    lambda: _queue_handler.queue.qsize() if _queue_handler is not None else 0)
+
+def get_logging_stats() -> dict:
+    if _queue_handler is None:
+        return {}
+    return {
+        "queued": _queue_handler.queue.qsize(),
+        "max_queued": settings.log_queue_size,
+        "dropped": _queue_handler.dropped
+    }
 
 def get_security_logger():
     return logging.getLogger("security")
 
 sql_logger = logging.getLogger('sqlalchemy.engine')
 sql_logger.propagate = False # to avoid duplicates log records
-sql_logger.setLevel(logging.INFO)
\ No newline at end of file
+sql_logger.setLevel(logging.INFO)
+
+httpx_logger = logging.getLogger('httpx')
+httpx_logger.setLevel(logging.WARNING) # a line for every push gateway request otherwise
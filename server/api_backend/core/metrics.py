@@ -0,0 +1,188 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import bisect
+import glob
+import json
+import os
+import threading
+
+# upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self.counts)
+            total_sum = self.sum
+            total_count = self.count
+        cumulative = 0
+        buckets = {}
+        for le, n in zip(self.buckets + ("+Inf",), counts):
+            cumulative += n
+            buckets[str(le)] = cumulative
+        return {"buckets": buckets, "sum": total_sum, "count": total_count}
+
+_histograms: dict[tuple, Histogram] = {}
+_registry_lock = threading.Lock()
+
+def get_histogram(name: str, **labels) -> Histogram:
+    key = (name, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _registry_lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    return histogram
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+_counters: dict[tuple, Counter] = {}
+
+def get_counter(name: str, **labels) -> Counter:
+    key = (name, tuple(sorted(labels.items())))
+    counter = _counters.get(key)
+    if counter is None:
+        with _registry_lock:
+            counter = _counters.setdefault(key, Counter())
+    return counter
+
+# gauges are read when collected (for example queue depths), by name
+_gauges: dict[str, object] = {}
+
+def register_gauge(name: str, func):
+    _gauges[name] = func
+
+def collect() -> dict:
+    gauges = []
+    for name, func in list(_gauges.items()):
+        try:
+            gauges.append([name, [], float(func())])
+        except Exception:
+            pass
+    return {
+        "histograms": [[name, list(labels), h.snapshot()] for (name, labels), h in list(_histograms.items())],
+        "counters": [[name, list(labels), c.value] for (name, labels), c in list(_counters.items())],
+        "gauges": gauges
+    }
+
+# With many server workers, every worker writes its own snapshot in METRICS_DIR 
+# and the worker answering the scrape sums them
+
+def snapshot_path(metrics_dir: str, pid: int) -> str:
+    return os.path.join(metrics_dir, f"worker_{pid}.json")
+
+def write_snapshot(metrics_dir: str):
+    path = snapshot_path(metrics_dir, os.getpid())
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(collect(), f)
+    os.replace(tmp_path, path) # readers never see a partial file
+
+def remove_snapshot(metrics_dir: str):
+    try:
+        os.remove(snapshot_path(metrics_dir, os.getpid()))
+    except FileNotFoundError:
+        pass
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def read_snapshots(metrics_dir: str) -> list[dict]:
+    snapshots = []
+    for path in glob.glob(os.path.join(metrics_dir, "worker_*.json")):
+        try:
+            pid = int(os.path.basename(path)[len("worker_"):-len(".json")])
+            if not is_process_alive(pid):
+                os.remove(path) # a dead worker (a new one starts from zero)
+                continue
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (ValueError, OSError):
+            continue
+    return snapshots
+
+def merge_snapshots(snapshots: list[dict]) -> dict:
+    histograms = {}
+    counters = {}
+    gauges = {}
+    for snapshot in snapshots:
+        for name, labels, data in snapshot["histograms"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            merged = histograms.setdefault(key, {"buckets": {}, "sum": 0.0, "count": 0})
+            for le, n in data["buckets"].items():
+                merged["buckets"][le] = merged["buckets"].get(le, 0) + n
+            merged["sum"] += data["sum"]
+            merged["count"] += data["count"]
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snapshot["gauges"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            gauges[key] = gauges.get(key, 0) + value
+    return {
+        "histograms": [[name, list(labels), data] for (name, labels), data in histograms.items()],
+        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+        "gauges": [[name, list(labels), value] for (name, labels), value in gauges.items()]
+    }
+
+def format_labels(labels, extra: tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+# Prometheus text exposition format (version 0.0.4)
+def render_prometheus(metrics: dict, prefix: str = "quidalert_") -> str:
+    lines = []
+    typed = set()
+
+    def add_type(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for name, labels, data in sorted(metrics["histograms"], key=lambda m: (m[0], m[1])):
+        name = prefix + name
+        add_type(name, "histogram")
+        for le, n in data["buckets"].items():
+            lines.append(f"{name}_bucket{format_labels(labels, (('le', le),))} {n}")
+        lines.append(f"{name}_sum{format_labels(labels)} {data['sum']}")
+        lines.append(f"{name}_count{format_labels(labels)} {data['count']}")
+    for name, labels, value in sorted(metrics["counters"], key=lambda m: (m[0], m[1])):
+        name = prefix + name
+        add_type(name, "counter")
+        lines.append(f"{name}{format_labels(labels)} {value}")
+    for name, labels, value in sorted(metrics["gauges"], key=lambda m: (m[0], m[1])):
+        name = prefix + name
+        add_type(name, "gauge")
+        lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
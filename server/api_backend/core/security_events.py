@@ -98,4 +98,22 @@ def log_login_token_generation(user_id: str):
     logger.info(
         "login_token_generation",
         extra=get_base_extra(user_id)
-    )
\ No newline at end of file
+    )
+
+def log_user_marked_unreliable(user_id: str):
+    logger.warning(
+        "user_marked_unreliable",
+        extra=get_base_extra(user_id)
+    )
+
+def log_refresh_tokens_purged(counts: dict):
+    logger.info(
+        "refresh_tokens_purged " + " ".join(f"{k}={v}" for k, v in counts.items()),
+        extra=counts
+    )
+
+def log_expired_registrations_purged(count: int):
+    logger.info(
+        f"expired_registrations_purged count={count}",
+        extra={"count": count}
+    )
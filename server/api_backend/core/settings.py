@@ -16,13 +16,87 @@ class Settings(BaseSettings):
     server_name: str = config.SERVER_NAME
     server_port: int = config.SERVER_PORT
     app_log_level: str = config.APP_LOG_LEVEL
+    log_format: str = config.LOG_FORMAT
+    log_queue_size: int = config.LOG_QUEUE_SIZE
     db_url: str = config.DB_URL
     db_engine_log_enabled: str = config.DB_ENGINE_LOG_ENABLED
     db_engine_echo: bool = False
+    db_pool_size: int = config.DB_POOL_SIZE
+    db_max_overflow: int = config.DB_MAX_OVERFLOW
+    db_pool_timeout: int = config.DB_POOL_TIMEOUT
+    db_pool_recycle: int = config.DB_POOL_RECYCLE
+    db_pool_pre_ping: bool = config.DB_POOL_PRE_PING
     cors_allow_origins: list = []
     smtp_host: str = config.SMTP_HOST
     smtp_port: int = config.SMTP_PORT
     smtp_from: str = config.SMTP_FROM
+    smtp_pool_size: int = config.SMTP_POOL_SIZE
+    smtp_timeout: int = config.SMTP_TIMEOUT
+    smtp_idle_seconds: int = config.SMTP_IDLE_SECONDS
+    mail_dispatch_batch_size: int = config.MAIL_DISPATCH_BATCH_SIZE
+    mail_dispatch_concurrency: int = config.MAIL_DISPATCH_CONCURRENCY
+    mail_dispatch_poll_seconds: float = config.MAIL_DISPATCH_POLL_SECONDS
+    mail_claim_seconds: int = config.MAIL_CLAIM_SECONDS
+    mail_max_attempts: int = config.MAIL_MAX_ATTEMPTS
+    mail_retry_base_seconds: int = config.MAIL_RETRY_BASE_SECONDS
+    mail_retry_max_seconds: int = config.MAIL_RETRY_MAX_SECONDS
+    mail_outbox_retention_hours: int = config.MAIL_OUTBOX_RETENTION_HOURS
+    refresh_token_sweep_seconds: int = config.REFRESH_TOKEN_SWEEP_SECONDS
+    registration_sweep_seconds: int = config.REGISTRATION_SWEEP_SECONDS
+    maintenance_batch_size: int = config.MAINTENANCE_BATCH_SIZE
+    password_hash_executor: str = config.PASSWORD_HASH_EXECUTOR
+    password_hash_workers: int = config.PASSWORD_HASH_WORKERS
+    user_cache_ttl_seconds: int = config.USER_CACHE_TTL_SECONDS
+    user_cache_max_entries: int = config.USER_CACHE_MAX_ENTRIES
+    token_cache_max_entries: int = config.TOKEN_CACHE_MAX_ENTRIES
+    rate_limit_enabled: bool = config.RATE_LIMIT_ENABLED
+    rate_limit_ip_per_minute: float = config.RATE_LIMIT_IP_PER_MINUTE
+    rate_limit_ip_burst: int = config.RATE_LIMIT_IP_BURST
+    rate_limit_account_per_minute: float = config.RATE_LIMIT_ACCOUNT_PER_MINUTE
+    rate_limit_account_burst: int = config.RATE_LIMIT_ACCOUNT_BURST
+    rate_limit_max_keys: int = config.RATE_LIMIT_MAX_KEYS
+    rate_limit_trusted_proxies: list = config.RATE_LIMIT_TRUSTED_PROXIES
+    alert_buffer_size: int = config.ALERT_BUFFER_SIZE
+    alert_batch_size: int = config.ALERT_BATCH_SIZE
+    alert_flush_seconds: float = config.ALERT_FLUSH_SECONDS
+    incident_radius_km: float = config.INCIDENT_RADIUS_KM
+    incident_window_seconds: float = config.INCIDENT_WINDOW_SECONDS
+    incident_max_seconds: float = config.INCIDENT_MAX_SECONDS
+    whitelist_check_enabled: bool = config.WHITELIST_CHECK_ENABLED
+    whitelist_refresh_seconds: float = config.WHITELIST_REFRESH_SECONDS
+    whitelist_bloom_capacity: int = config.WHITELIST_BLOOM_CAPACITY
+    whitelist_bloom_error_rate: float = config.WHITELIST_BLOOM_ERROR_RATE
+    whitelist_batch_size: int = config.WHITELIST_BATCH_SIZE
+    whitelist_gap_seconds: float = config.WHITELIST_GAP_SECONDS
+    whitelist_rebuild_seconds: float = config.WHITELIST_REBUILD_SECONDS
+    credibility_min_votes: int = config.CREDIBILITY_MIN_VOTES
+    credibility_unreliable: float = config.CREDIBILITY_UNRELIABLE
+    location_flush_seconds: float = config.LOCATION_FLUSH_SECONDS
+    location_batch_size: int = config.LOCATION_BATCH_SIZE
+    location_buffer_size: int = config.LOCATION_BUFFER_SIZE
+    push_gateway_url: str = config.PUSH_GATEWAY_URL
+    push_gateway_token: str = "" # from environment (system or .env)
+    push_radius_km: float = config.PUSH_RADIUS_KM
+    push_official_radius_km: float = config.PUSH_OFFICIAL_RADIUS_KM
+    push_official_types: list = config.PUSH_OFFICIAL_TYPES
+    push_chiefs_radius_km: float = config.PUSH_CHIEFS_RADIUS_KM
+    push_batch_size: int = config.PUSH_BATCH_SIZE
+    push_max_in_flight: int = config.PUSH_MAX_IN_FLIGHT
+    push_timeout: float = config.PUSH_TIMEOUT
+    push_queue_size: int = config.PUSH_QUEUE_SIZE
+    push_workers: int = config.PUSH_WORKERS
+    stream_radius_km: float = config.STREAM_RADIUS_KM
+    stream_queue_size: int = config.STREAM_QUEUE_SIZE
+    stream_max_connections: int = config.STREAM_MAX_CONNECTIONS
+    stream_poll_seconds: float = config.STREAM_POLL_SECONDS
+    stream_heartbeat_seconds: float = config.STREAM_HEARTBEAT_SECONDS
+    nearby_max_radius_km: float = config.NEARBY_MAX_RADIUS_KM
+    nearby_max_results: int = config.NEARBY_MAX_RESULTS
+    users_page_max_size: int = config.USERS_PAGE_MAX_SIZE
+    users_export_chunk_size: int = config.USERS_EXPORT_CHUNK_SIZE
+    metrics_allowed_ips: list = config.METRICS_ALLOWED_IPS
+    metrics_dir: str = config.METRICS_DIR
+    metrics_snapshot_seconds: float = config.METRICS_SNAPSHOT_SECONDS
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -43,6 +117,14 @@ except Exception as e:
     print(f"Configuration error: {e}")
     raise SystemExit(1)
 
+if settings.password_hash_executor not in ("thread", "process"):
+    print(f"Configuration error: PASSWORD_HASH_EXECUTOR must be 'thread' or 'process'")
+    raise SystemExit(1)
+
+if settings.password_hash_workers < 1:
+    print(f"Configuration error: PASSWORD_HASH_WORKERS must be greater than 0")
+    raise SystemExit(1)
+
 if (not settings.admin_pass) or (settings.admin_pass==""):
     print(f"Configuration error: environment var ADMIN_PASS not found")
     raise SystemExit(1)
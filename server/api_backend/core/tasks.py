@@ -0,0 +1,30 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import asyncio
+import logging
+
+logger = logging.getLogger("tasks")
+
+# It runs "func" (a coroutine function) every "interval_seconds" (the first time at once
+# with "run_first"), until cancelled
+async def run_periodically(name: str, interval_seconds: float, func, run_first: bool = False):
+    delay = 0 if run_first else interval_seconds
+    while True:
+        await asyncio.sleep(delay)
+        delay = interval_seconds
+        try:
+            await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"periodic task {name} failed")
+
+def start_periodic_task(name: str, interval_seconds: float, func, run_first: bool = False) -> asyncio.Task:
+    return asyncio.create_task(run_periodically(name, interval_seconds, func, run_first), name=name)
+
+async def stop_tasks(tasks: list):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
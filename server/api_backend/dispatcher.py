@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+# Mail outbox dispatcher: it runs as a separate process (next to the api server)
+
+import argparse
+import logging
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from sqlmodel import Session
+from core.settings import settings
+from core.logging import setup_logging
+from core.dbmgr import get_engine
+from core.metrics import write_snapshot, remove_snapshot
+from services.network import close_mail_pool
+from services.outbox import (claim_mail_batch, send_outbox_mails, 
+    record_mail_results, purge_sent_mails)
+
+logger = logging.getLogger("dispatcher")
+stopping = False
+
+def stop(signum, frame):
+    global stopping
+    stopping = True
+
+def wait(seconds: float):
+    end = time.monotonic() + seconds
+    while (not stopping) and (time.monotonic() < end):
+        time.sleep(0.2)
+
+def run(batch_size: int, concurrency: int, poll_seconds: float, once: bool):
+    engine = get_engine(settings.db_url)
+    # every sending thread needs its own smtp connection
+    settings.smtp_pool_size = max(settings.smtp_pool_size, concurrency)
+    totals = {"sent": 0, "retry": 0, "failed": 0}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="mail") as executor:
+            while not stopping:
+                with Session(engine, expire_on_commit=False) as db_session:
+                    records = claim_mail_batch(db_session, batch_size)
+                    if records:
+                        start = time.perf_counter()
+                        errors = send_outbox_mails(records, executor, concurrency)
+                        counts = record_mail_results(db_session, records, errors)
+                        for k in totals:
+                            totals[k] += counts[k]
+                        logger.info("mail_batch_dispatched size=%d sent=%d retry=%d failed=%d seconds=%.3f "
+                            "total_sent=%d total_retry=%d total_failed=%d", len(records), 
+                            counts["sent"], counts["retry"], counts["failed"], time.perf_counter() - start,
+                            totals["sent"], totals["retry"], totals["failed"])
+                        if settings.metrics_dir: # mail send times, in the api /api/metrics
+                            write_snapshot(settings.metrics_dir)
+                    else:
+                        purge_sent_mails(db_session, batch_size)
+                if len(records) < batch_size: # else there is more work, we go on immediately
+                    if once:
+                        break
+                    wait(poll_seconds)
+    finally:
+        close_mail_pool()
+        engine.dispose()
+        if settings.metrics_dir:
+            remove_snapshot(settings.metrics_dir)
+
+if (__name__ ==  "__main__"):
+    load_dotenv()
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Quidalert mail outbox dispatcher")
+    parser.add_argument("--batch-size", type=int, default=settings.mail_dispatch_batch_size)
+    parser.add_argument("--concurrency", type=int, default=settings.mail_dispatch_concurrency)
+    parser.add_argument("--poll-seconds", type=float, default=settings.mail_dispatch_poll_seconds)
+    parser.add_argument("--once", action="store_true", help="send the due mails and exit")
+    args = parser.parse_args()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print("Starting mail dispatcher...")
+    run(args.batch_size, args.concurrency, args.poll_seconds, args.once)
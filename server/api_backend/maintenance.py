@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+# Maintenance jobs, to be run by hand or by a scheduler (cron, systemd timers)
+# when the api server periodic tasks are disabled
+
+import argparse
+import asyncio
+from dotenv import load_dotenv
+from core.settings import settings
+from core.logging import setup_logging
+from core.dbmgr import get_async_engine, get_async_session
+from core.security_events import log_refresh_tokens_purged, log_expired_registrations_purged
+from services.maintenance import purge_refresh_tokens, purge_expired_registrations
+from services.whitelist import import_whitelist, iter_lines
+
+async def run_refresh_tokens(batch_size: int):
+    engine = get_async_engine(settings.db_url)
+    try:
+        async for db_session in get_async_session(engine):
+            counts = await purge_refresh_tokens(db_session, batch_size)
+            log_refresh_tokens_purged(counts)
+            print(f"Refresh tokens deleted: {counts}")
+    finally:
+        await engine.dispose()
+
+async def run_registrations(batch_size: int):
+    engine = get_async_engine(settings.db_url)
+    try:
+        async for db_session in get_async_session(engine):
+            count = await purge_expired_registrations(db_session, batch_size)
+            log_expired_registrations_purged(count)
+            print(f"Expired registrations deleted: {count}")
+    finally:
+        await engine.dispose()
+
+async def run_whitelist_import(path: str, batch_size: int):
+    engine = get_async_engine(settings.db_url)
+    try:
+        with open(path, "rb") as f:
+            async def read(size: int) -> bytes:
+                return f.read(size)
+            async for db_session in get_async_session(engine):
+                counts = await import_whitelist(db_session, iter_lines(read), batch_size)
+                print(f"Whitelist rows: {counts['rows']}, imported: {counts['imported']}, "
+                    f"invalid: {counts['invalid']}")
+                for error in counts["errors"]:
+                    print(error)
+    finally:
+        await engine.dispose()
+
+if (__name__ ==  "__main__"):
+    load_dotenv()
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Quidalert maintenance jobs")
+    parser.add_argument("--batch-size", type=int, default=settings.maintenance_batch_size)
+    subparsers = parser.add_subparsers(dest="job", required=True)
+    subparsers.add_parser("refresh-tokens", help="delete revoked, expired and surplus refresh tokens")
+    subparsers.add_parser("registrations", help="delete never activated users with expired activation")
+    whitelist_parser = subparsers.add_parser("whitelist-import", 
+        help="import a CSV whitelist (header: email,firstname,surname,type), existing emails are updated")
+    whitelist_parser.add_argument("file")
+    args = parser.parse_args()
+    if args.job == "refresh-tokens":
+        asyncio.run(run_refresh_tokens(args.batch_size))
+    elif args.job == "registrations":
+        asyncio.run(run_registrations(args.batch_size))
+    elif args.job == "whitelist-import":
+        asyncio.run(run_whitelist_import(args.file, settings.whitelist_batch_size))
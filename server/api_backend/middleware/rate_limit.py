@@ -0,0 +1,67 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import math
+import time
+from collections import OrderedDict
+from core.exceptions import too_many_requests_exception
+
+# Token buckets by key (client ip, email hash...): "burst" requests at once,
+# then "per_minute" requests per minute. Memory is bounded by "max_keys"
+# (the least recently used buckets are dropped). Use it from the event loop only.
+# Limits must be positive (RATE_LIMIT_ENABLED turns the limits off).
+class TokenBucketLimiter:
+    def __init__(self, per_minute: float, burst: int, max_keys: int):
+        if (per_minute <= 0) or (burst < 1):
+            raise ValueError(f"Rate limit not valid: {per_minute} per minute, burst {burst}")
+        self.rate = per_minute / 60.0 # tokens per second
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict() # key -> (tokens, last update time)
+        self.allowed = 0
+        self.rejected = 0
+
+    # It returns 0 if the request is allowed, else the seconds to wait
+    def acquire(self, key: str) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = float(self.burst)
+        else:
+            tokens = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            self._buckets.move_to_end(key)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            self.allowed += 1
+            return 0.0
+        self._buckets[key] = (tokens, now)
+        self.rejected += 1
+        return (1 - tokens) / self.rate
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected
+        }
+
+# The address limited is the direct peer, or, when the peer is a trusted proxy, the hop
+# that proxy appended to X-Forwarded-For (the last one not written by a trusted proxy):
+# the values before it are written by the client, a new one on every request would get
+# a new bucket
+def get_rate_limit_key(peer_ip: str | None, forwarded_for: str | None, trusted_proxies: list) -> str:
+    ip = peer_ip
+    if forwarded_for and (ip in trusted_proxies):
+        for hop in reversed(forwarded_for.split(",")):
+            ip = hop.strip()
+            if ip not in trusted_proxies:
+                break
+    return ip or "-"
+
+def check_rate_limit(limiter: TokenBucketLimiter, key: str):
+    wait = limiter.acquire(key)
+    if wait > 0:
+        raise too_many_requests_exception(math.ceil(wait))
@@ -3,26 +3,58 @@
 # Licensed under the GNU GPL v3 or later. See LICENSE for details.
 
 import contextvars
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+import time
+import uuid as uuid_pkg
+from starlette.datastructures import Headers, MutableHeaders
+from core.metrics import get_histogram, get_counter
 
 request_id_ctx = contextvars.ContextVar("request_id")
 client_ip_ctx = contextvars.ContextVar("client_ip")
 client_ua_ctx = contextvars.ContextVar("client_ua")
 
-class RequestContextMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        rid = request.headers.get("x-request-id")
-        xff = request.headers.get("x-forwarded-for")
-        ua = request.headers.get("user-agent", "")
+# A plain ASGI middleware (no extra task or response stream wrapping): 
+# it sets the request context vars and measures the latency of every route
+class RequestContextMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        rid = headers.get("x-request-id") or uuid_pkg.uuid4().hex
+        xff = headers.get("x-forwarded-for")
+        ua = headers.get("user-agent", "")
         request_id_ctx.set(rid)
         if xff:
             client_ip = xff.split(",")[0].strip()
         else:
-            client_ip = request.client.host if request.client else None
+            client = scope.get("client")
+            client_ip = client[0] if client else None
         client_ip_ctx.set(client_ip)
         client_ua_ctx.set(ua)
-        response = await call_next(request)
-        if rid:
-            response.headers["X-Request-ID"] = rid
-        return response
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500 # if the app raises before the response starts
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)["X-Request-ID"] = rid
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            get_histogram("http_request_seconds", method=scope["method"], 
+                route=path).observe(time.perf_counter() - start)
+            get_counter("http_requests_total", method=scope["method"], 
+                route=path, status=str(status_code)).inc()
@@ -8,7 +8,7 @@ from typing import Optional
 from enum import Enum
 import uuid as uuid_pkg
 from pydantic import BaseModel, EmailStr, field_validator, model_validator
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Index, UniqueConstraint
 from services.security import now_tz_naive
 
 class UserType(str, Enum):
@@ -31,6 +31,18 @@ class UserLanguage(str, Enum):
     en = "en"
     it = "it"
 
+class MailKind(str, Enum):
+    activation = "activation"
+    reset_code = "reset_code"
+    reset_successful = "reset_successful"
+    login_successful = "login_successful"
+    login_code = "login_code"
+
+class MailStatus(str, Enum):
+    pending = "pending"
+    sent = "sent"
+    failed = "failed"
+
 class UserBase(SQLModel, table=False):
     firstname: str = Field(nullable=False, min_length=2, max_length=64)
     surname: str = Field(nullable=False, min_length=2, max_length=64)
@@ -71,8 +83,11 @@ class UserOut(UserBase, table=False):
     is_chief: bool = Field(default=False, nullable=False)
     type: str = Field(default=UserType.citizen, nullable=False)
     status: str = Field(default=UserStatus.ok, nullable=False)
+    # votes received by the alerts of the user (see services/votes.py)
+    alert_votes_up: int = Field(default=0, nullable=False)
+    alert_votes_down: int = Field(default=0, nullable=False)
     is_active: bool = Field(default=False, nullable=False)
-    activation_expires_at: Optional[datetime] = Field(default=None)
+    activation_expires_at: Optional[datetime] = Field(default=None, index=True)
     reset_expires_at: Optional[datetime] = Field(default=None)
     reset_attempts: int = Field(default=0, nullable=False)
     reset_locked_until: Optional[datetime] = Field(default=None)
@@ -108,11 +123,17 @@ class UserOut(UserBase, table=False):
         
 class User(UserOut, table=True):
     __tablename__: str = 'users'
+    __table_args__ = (
+        Index("ix_users_created_at_id", "created_at", "id"), # admin listing (keyset pagination)
+        Index("ix_users_gps_cell_id", "gps_cell", "id"), # nearby users, in keyset chunks (services/push.py)
+    )
     # todo: insert foreign key to whitelist table
     email_hash: str = Field(index=True, unique=True, nullable=False)
     password_hash: str = Field(nullable=False)
     gps_lat: float | None = Field(default=None, nullable=True)
     gps_lon: float | None = Field(default=None, nullable=True)
+    gps_cell: Optional[int] = Field(default=None) # see services/geo.py
+    gps_updated_at: Optional[datetime] = Field(default=None)
     activation_code: Optional[str] = Field(default=None)    
     reset_code_hash: Optional[str] = Field(default=None)
     login_code_hash: Optional[str] = Field(default=None)
@@ -141,6 +162,15 @@ class User(UserOut, table=True):
             raise ValueError("Latitude and Longitude must have either a value or be None")
         return self
 
+class UserNearby(UserOut, table=False):
+    gps_lat: float
+    gps_lon: float
+    distance_km: float
+
+class UserPage(BaseModel):
+    users: list[UserOut]
+    next_cursor: Optional[str] = None # None on the last page
+
 class PasswordResetRequest(BaseModel):
     email: EmailStr
 
@@ -182,7 +212,7 @@ class RefreshToken(SQLModel, table=True):
     ip_address: Optional[str] = Field(default=None)
     device_info: Optional[str] = Field(default=None)
     updated_at: datetime = Field(
-        default_factory=lambda: now_tz_naive()
+        default_factory=lambda: now_tz_naive(), index=True
     )
     is_revoked: bool = Field(default=False)
 
@@ -205,14 +235,35 @@ class LoginSchema(BaseModel):
 class RefreshTokenWrapper(BaseModel):
     refresh_token: str
 
+# Alerts about the same event, near in space and time (see services/incidents.py)
+class Incident(SQLModel, table=True):
+    __tablename__: str = "incidents"
+    id: uuid_pkg.UUID = Field(default_factory=uuid_pkg.uuid4, primary_key=True, nullable=False)
+    first_alert_ref: uuid_pkg.UUID = Field(nullable=False) # the alert that opened it
+    gps_lat: float = Field(nullable=False) # centroid of the alerts
+    gps_lon: float = Field(nullable=False)
+    gps_cell: int = Field(nullable=False, index=True)
+    alert_count: int = Field(default=0, nullable=False)
+    max_severity: int = Field(default=0, nullable=False)
+    first_alert_at: datetime = Field(nullable=False)
+    last_alert_at: datetime = Field(nullable=False, index=True)
+    merged_into: Optional[uuid_pkg.UUID] = Field(default=None, nullable=True)
+
 class Alert(SQLModel, table=True):
     __tablename__: str = "alerts"
     id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
+    # public id, known before the buffered insert (see services/alerts.py)
+    ref: uuid_pkg.UUID = Field(default_factory=uuid_pkg.uuid4, nullable=False, unique=True, index=True)
     user_id: uuid_pkg.UUID = Field(foreign_key="users.id", nullable=False, index=True)
     description: str = Field(default="", nullable=False, min_length=0, max_length=256)
     severity: Optional[int] = Field(default=0, nullable=False)
+    gps_lat: float | None = Field(default=None, nullable=True)
+    gps_lon: float | None = Field(default=None, nullable=True)
     created_at: datetime = Field(default_factory=lambda: now_tz_naive(), nullable=False)
     is_closed: bool = Field(default=False, nullable=False)
+    incident_id: Optional[uuid_pkg.UUID] = Field(default=None, foreign_key="incidents.id", index=True)
+    votes_up: int = Field(default=0, nullable=False)
+    votes_down: int = Field(default=0, nullable=False)
 
     @field_validator("severity")
     @classmethod
@@ -223,6 +274,58 @@ class Alert(SQLModel, table=True):
             raise ValueError("Severity must be between 0 and 5")
         return v
     
+class AlertVote(SQLModel, table=True):
+    __tablename__: str = "alert_votes"
+    __table_args__ = (
+        UniqueConstraint("alert_id", "user_id", name="uq_alert_votes_alert_id_user_id"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
+    alert_id: int = Field(foreign_key="alerts.id", nullable=False)
+    user_id: uuid_pkg.UUID = Field(foreign_key="users.id", nullable=False, index=True)
+    is_valid: bool = Field(nullable=False) # the alert is true (or false)
+    created_at: datetime = Field(default_factory=lambda: now_tz_naive(), nullable=False)
+
+class AlertIn(BaseModel):
+    description: str = Field(default="", min_length=0, max_length=256)
+    severity: int = Field(default=0, ge=0, le=5)
+    gps_lat: float = Field(ge=-90, le=90)
+    gps_lon: float = Field(ge=-180, le=180)
+
+class LocationIn(BaseModel):
+    gps_lat: float = Field(ge=-90, le=90)
+    gps_lon: float = Field(ge=-180, le=180)
+
+class AlertVoteIn(BaseModel):
+    is_valid: bool
+
+class AlertVotes(BaseModel):
+    ref: uuid_pkg.UUID
+    votes_up: int
+    votes_down: int
+    credibility: float
+    counted: bool # False if the user had already voted
+
+class AlertAccepted(BaseModel):
+    ref: uuid_pkg.UUID
+    incident_id: uuid_pkg.UUID | None = None
+
+class MailOutbox(SQLModel, table=True):
+    __tablename__: str = 'mail_outbox'
+    __table_args__ = (
+        Index("ix_mail_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
+    kind: str = Field(nullable=False)
+    email: str = Field(nullable=False, max_length=128)
+    language: str = Field(default=UserLanguage.en, nullable=False)
+    code: Optional[str] = Field(default=None) # activation token or otp code (cleared when sent)
+    status: str = Field(default=MailStatus.pending, nullable=False)
+    attempts: int = Field(default=0, nullable=False)
+    next_attempt_at: datetime = Field(default_factory=lambda: now_tz_naive(), nullable=False)
+    last_error: Optional[str] = Field(default=None, max_length=256)
+    created_at: datetime = Field(default_factory=lambda: now_tz_naive(), nullable=False)
+    sent_at: Optional[datetime] = Field(default=None)
+
 class WhiteRecordIn(SQLModel, table=False):
     firstname: Optional[str] = Field(nullable=True, max_length=64)
     surname: Optional[str] = Field(nullable=True, max_length=64)
@@ -241,3 +344,4 @@ class WhiteRecordIn(SQLModel, table=False):
 class WhiteRecord(WhiteRecordIn, table=True):
     __tablename__: str = 'whitelist'
     id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
+    email_hash: str = Field(index=True, unique=True, nullable=False) # normalized email (see services/whitelist.py)
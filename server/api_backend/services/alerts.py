@@ -0,0 +1,165 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import asyncio
+import logging
+import time
+from contextlib import aclosing
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import insert, select
+from core.dbmgr import get_async_session
+from core.metrics import get_histogram
+from models.general import Alert
+
+logger = logging.getLogger("alerts")
+
+# the INSERT of the alerts violates a constraint (a problem of the rows, not of the database)
+class AlertsRejected(Exception):
+    pass
+
+# Alerts are accepted into memory and written by a background task with multi-row
+# INSERTs (when a batch is full or every "flush_seconds"), so a burst of reports
+# doesn't wait on one commit per alert. The buffer is bounded: when it's full (the
+# database is slow or down) new alerts are refused. Alerts still in memory are lost
+# if the process crashes (they are written at a normal shutdown).
+# With a clusterer, every alert gets its incident (see services/incidents.py) when accepted.
+class AlertBuffer:
+    def __init__(self, max_size: int, batch_size: int, flush_seconds: float, clusterer=None):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.clusterer = clusterer
+        self.rows: list[dict] = []
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.flush_histogram = get_histogram("alert_flush_seconds")
+        self.on_flush = [] # functions called with every written batch (a list of rows)
+        self.unsettled = None # (batch size, incident changes) of a commit cancelled midway
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    # it returns False if the buffer is full
+    def add(self, row: dict) -> bool:
+        if len(self.rows) >= self.max_size:
+            self.rejected += 1
+            return False
+        if self.clusterer is not None:
+            row["incident_id"] = self.clusterer.assign(row)
+        self.rows.append(row)
+        self.accepted += 1
+        if len(self.rows) >= self.batch_size:
+            self._batch_ready.set()
+        return True
+
+    async def flush(self, engine):
+        async with self._flush_lock:
+            await self._settle(engine)
+            while self.rows:
+                batch = self.rows[:self.batch_size]
+                try:
+                    await self._write(engine, batch)
+                except AlertsRejected:
+                    # a row that can't be written (its user was deleted meanwhile) must not block
+                    # the others: the batch is written row by row
+                    logger.warning(f"alert batch of {len(batch)} rejected, writing it row by row")
+                    for row in batch:
+                        try:
+                            await self._write(engine, [row])
+                        except AlertsRejected:
+                            del self.rows[0]
+                            self.dropped += 1
+                            if self.clusterer is not None:
+                                self.clusterer.discard(row)
+                            logger.exception(f"alert {row['ref']} dropped, it can't be written")
+
+    # The batch (the head of the buffer) leaves the buffer as soon as it's committed, a
+    # failed batch is written at the next flush. Only a failed INSERT of the alerts raises
+    # AlertsRejected (the incident changes are retried with the batch).
+    async def _write(self, engine, batch: list[dict]):
+        start = time.perf_counter()
+        incidents = None
+        committing = committed = False
+        try:
+            # the session is closed (its transaction rolled back) before a retry
+            async with aclosing(get_async_session(engine)) as sessions:
+                async for db_session in sessions:
+                    if self.clusterer is not None:
+                        incidents = await self.clusterer.write(db_session, self.rows)
+                    try:
+                        await db_session.exec(insert(Alert).values(batch))
+                    except IntegrityError as e:
+                        raise AlertsRejected() from e
+                    committing = True
+                    await db_session.commit()
+                    committed = True
+                    del self.rows[:len(batch)]
+        except BaseException as e:
+            if committed: # interrupted while closing the session, the batch is written
+                self._written(batch, start)
+            elif committing and isinstance(e, asyncio.CancelledError):
+                # the commit may be done: the next flush looks for the batch before writing
+                # it again, so neither the alerts nor the incident counters are counted twice
+                self.unsettled = (len(batch), incidents)
+            elif incidents is not None:
+                self.clusterer.restore(incidents)
+            raise
+        self._written(batch, start)
+
+    async def _settle(self, engine):
+        if self.unsettled is None:
+            return
+        size, incidents = self.unsettled
+        async with aclosing(get_async_session(engine)) as sessions:
+            async for db_session in sessions:
+                q = select(Alert.id).where(Alert.ref == self.rows[0]["ref"])
+                written = (await db_session.exec(q)).first() is not None
+        self.unsettled = None
+        if written:
+            batch = self.rows[:size]
+            del self.rows[:size]
+            self._written(batch, time.perf_counter())
+        elif incidents is not None:
+            self.clusterer.restore(incidents)
+
+    def _written(self, batch: list[dict], start: float):
+        self.flush_histogram.observe(time.perf_counter() - start)
+        self.written += len(batch)
+        self.batches += 1
+        for callback in self.on_flush:
+            try:
+                callback(batch)
+            except Exception:
+                logger.exception("alert flush callback failed")
+
+    async def run(self, engine):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.flush(engine)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failures += 1
+                logger.exception(f"alert flush failed, {len(self.rows)} alerts waiting")
+                await asyncio.sleep(self.flush_seconds) # no busy loop while the db is down
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self.rows),
+            "max_queued": self.max_size,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped
+        }
@@ -0,0 +1,100 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import math
+import heapq
+from sqlmodel import select, col, or_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.general import User
+
+# The world is divided in a grid of GPS_CELL_DEGREES x GPS_CELL_DEGREES cells (about 5.5 km
+# of latitude), numbered row by row: users.gps_cell (B-tree indexed, with the id) is the cell of the user
+# position, so a radius query reads one index range per grid row instead of the whole table.
+# Changing GPS_CELL_DEGREES requires recomputing users.gps_cell.
+GPS_CELL_DEGREES = 0.05
+GRID_ROWS = round(180 / GPS_CELL_DEGREES)
+GRID_COLS = round(360 / GPS_CELL_DEGREES)
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+NEARBY_CHUNK_SIZE = 1000 # rows per read of the nearby users query
+
+def cell_row(lat: float) -> int:
+    return min(GRID_ROWS - 1, max(0, math.floor((lat + 90) / GPS_CELL_DEGREES)))
+
+def cell_col(lon: float) -> int:
+    return math.floor((lon + 180) / GPS_CELL_DEGREES) % GRID_COLS
+
+def cell_for(lat: float | None, lon: float | None) -> int | None:
+    if (lat is None) or (lon is None):
+        return None
+    return cell_row(lat) * GRID_COLS + cell_col(lon)
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+# Inclusive (first, last) gps_cell ranges covering the circle: one (or two, across the
+# antimeridian) for every grid row
+def cell_ranges(lat: float, lon: float, radius_km: float) -> list[tuple[int, int]]:
+    dlat = radius_km / KM_PER_DEGREE
+    lat_min = max(-90.0, lat - dlat)
+    lat_max = min(90.0, lat + dlat)
+    # the widest longitude span is at the latitude farthest from the equator
+    max_abs_lat = max(abs(lat_min), abs(lat_max))
+    cos_lat = math.cos(math.radians(max_abs_lat))
+    if (max_abs_lat >= 89.9) or (radius_km / (KM_PER_DEGREE * cos_lat) >= 180):
+        col_spans = [(0, GRID_COLS - 1)] # a pole is inside, every longitude
+    else:
+        dlon = radius_km / (KM_PER_DEGREE * cos_lat)
+        first = cell_col(lon - dlon)
+        last = cell_col(lon + dlon)
+        if first <= last:
+            col_spans = [(first, last)]
+        else:
+            col_spans = [(first, GRID_COLS - 1), (0, last)]
+    ranges = []
+    for row in range(cell_row(lat_min), cell_row(lat_max) + 1):
+        base = row * GRID_COLS
+        ranges.extend((base + first, base + last) for first, last in col_spans)
+    return ranges
+
+# SQL condition: rows (users by default) in the cells covering the circle (a superset of the circle)
+def near_condition(lat: float, lon: float, radius_km: float, cell_column=None):
+    cells = col(User.gps_cell if cell_column is None else cell_column)
+    return or_(*(cells.between(first, last) for first, last in cell_ranges(lat, lon, radius_km)))
+
+# Users within radius_km of the point, nearest first, as (user, distance_km). Only the id and
+# position of the users in the covering cells are read (streamed, a city can have hundreds of
+# thousands), the "limit" nearest are kept in a heap and only their rows are loaded.
+async def find_users_nearby(db_session: AsyncSession, lat: float, lon: float, radius_km: float,
+        user_type: str | None = None, is_active: bool | None = True,
+        limit: int | None = None) -> list[tuple[User, float]]:
+    q = select(User.id, User.gps_lat, User.gps_lon).where(near_condition(lat, lon, radius_km))
+    if user_type is not None:
+        q = q.where(User.type == user_type)
+    if is_active is not None:
+        q = q.where(User.is_active == is_active)
+    nearest = [] # (-distance, id): the farthest user kept is the first
+    result = await db_session.stream(q.execution_options(yield_per=NEARBY_CHUNK_SIZE))
+    async for rows in result.partitions():
+        for user_id, user_lat, user_lon in rows:
+            distance = haversine_km(lat, lon, user_lat, user_lon)
+            if distance > radius_km: # cells are squares: we keep the users inside the circle only
+                continue
+            if (not limit) or (len(nearest) < limit):
+                heapq.heappush(nearest, (-distance, user_id))
+            elif distance < -nearest[0][0]:
+                heapq.heapreplace(nearest, (-distance, user_id))
+    distances = {user_id: -distance for distance, user_id in nearest}
+    ids = list(distances)
+    found = []
+    for first in range(0, len(ids), NEARBY_CHUNK_SIZE):
+        q = select(User).where(col(User.id).in_(ids[first:first + NEARBY_CHUNK_SIZE]))
+        found.extend((user, distances[user.id]) for user in (await db_session.exec(q)).all())
+    found.sort(key=lambda item: item[1])
+    return found
@@ -0,0 +1,424 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import uuid as uuid_pkg
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, case, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import aliased
+from sqlmodel import select, update, col, or_
+from models.general import Alert, Incident
+from services.geo import cell_for, cell_ranges, haversine_km, near_condition
+from services.security import now_tz_naive
+
+incidents_table = Incident.__table__
+alerts_table = Alert.__table__
+
+ADOPT_CHUNK = 100 # incidents per query, when looking for the incidents of the other workers
+MAX_MERGE_HOPS = 16 # merged_into is followed at most this many times (chains are flattened)
+
+class OpenIncident:
+    __slots__ = ("id", "first_ref", "lat", "lon", "cell", "count", "severity", "first_at", "last_at", "written")
+
+    def __init__(self, id: uuid_pkg.UUID, first_ref: uuid_pkg.UUID, lat: float, lon: float, at: datetime):
+        self.id = id
+        self.first_ref = first_ref
+        self.lat = lat
+        self.lon = lon
+        self.cell = None
+        self.count = 0
+        self.severity = 0
+        self.first_at = at
+        self.last_at = at
+        self.written = False # the incidents row exists (or it's being inserted)
+
+    def add(self, lat: float, lon: float, count: int, severity: int, first_at: datetime, last_at: datetime):
+        total = self.count + count
+        self.lat = (self.lat * self.count + lat * count) / total
+        self.lon = (self.lon * self.count + lon * count) / total
+        self.count = total
+        self.severity = max(self.severity, severity)
+        self.first_at = min(self.first_at, first_at)
+        self.last_at = max(self.last_at, last_at)
+
+# Alerts about the same event are grouped in incidents as they are accepted (per server worker),
+# so the notifications are sent once per incident instead of once per alert:
+# - an alert joins the open incident whose centroid is nearest, within "radius_km", if the
+#   incident got an alert in the last "window_seconds" and it's younger than "max_seconds"
+#   (open incidents are indexed by the grid cell of their centroid: a few cells are visited)
+# - else it opens a new incident
+# - when the centroids of two incidents come within "radius_km", they are merged (the smaller
+#   one into the larger one, incidents.merged_into), two distinct events farther apart stay
+#   separated, and a long event is split in successive incidents after "max_seconds"
+# The changes (new incidents and counters increments) are written with the alerts, then a new
+# incident is compared with the open incidents of the other workers (one query per flush).
+# Every incident id given to the clients gets a row (merged ones point to the surviving one).
+class IncidentClusterer:
+    def __init__(self, radius_km: float, window_seconds: float, max_seconds: float):
+        self.radius_km = radius_km
+        self.window = timedelta(seconds=window_seconds)
+        self.max_duration = timedelta(seconds=max_seconds)
+        self.incidents: dict[uuid_pkg.UUID, OpenIncident] = {}
+        self.by_cell: dict[int, set] = {}
+        self.changes: dict[uuid_pkg.UUID, dict] = {} # incident id -> changes not yet written
+        self.merges: list[tuple] = [] # (absorbed id, surviving id) of written incidents
+        # replaced id -> new id (a chain, resolved when written): the ids in the buffered
+        # alerts and in the changes are replaced once per flush, not at every merge
+        self.renamed: dict[uuid_pkg.UUID, uuid_pkg.UUID] = {}
+        self.alerts = 0
+        self.opened = 0
+        self.merged = 0
+        self.adopted = 0
+        self.followed = 0
+        self.expired = 0
+
+    # it returns the incident id of the alert
+    def assign(self, alert: dict) -> uuid_pkg.UUID:
+        lat, lon, at, severity = alert["gps_lat"], alert["gps_lon"], alert["created_at"], alert["severity"]
+        self.alerts += 1
+        candidates = self._near(lat, lon, at)
+        if candidates:
+            candidates.sort(key=lambda item: item[0])
+            incident = candidates[0][1]
+        else:
+            incident = OpenIncident(uuid_pkg.uuid4(), alert["ref"], lat, lon, at)
+            self.incidents[incident.id] = incident
+            self.opened += 1
+        incident.add(lat, lon, 1, severity, at, at)
+        self._record(incident, lat, lon, 1, severity, at)
+        self._index(incident)
+        for _, other in candidates[1:]:
+            if (other.id in self.incidents) and (
+                    haversine_km(incident.lat, incident.lon, other.lat, other.lon) <= self.radius_km):
+                incident = self._merge(other, incident)
+        return incident.id
+
+    # An alert that can't be written leaves the counters of its incident (the centroid and
+    # times kept in memory are approximate)
+    def discard(self, alert: dict):
+        incident_id = self._resolve(alert["incident_id"])
+        incident = self.incidents.get(incident_id)
+        if (incident is not None) and (incident.count > 1):
+            incident.count -= 1
+        add_change(self.changes, incident_id, {"new": False, "first_ref": None,
+            "first_at": datetime.max, "count": -1, "lat_sum": -alert["gps_lat"], "lon_sum": -alert["gps_lon"],
+            "severity": 0, "last_at": datetime.min})
+
+    # the alerts of the batch that opened their incident (the ones to notify)
+    def first_alerts(self, alerts: list[dict]) -> list[dict]:
+        found = []
+        for alert in alerts:
+            incident = self.incidents.get(alert.get("incident_id"))
+            if (incident is not None) and (incident.first_ref == alert["ref"]):
+                found.append(alert)
+        return found
+
+    def _near(self, lat: float, lon: float, at: datetime) -> list[tuple]:
+        found = []
+        for first, last in cell_ranges(lat, lon, self.radius_km):
+            if last - first > len(self.by_cell): # faster to scan the occupied cells
+                cells = [c for c in self.by_cell if first <= c <= last]
+            else:
+                cells = range(first, last + 1)
+            for cell in cells:
+                for incident in self.by_cell.get(cell, ()):
+                    if (at - incident.last_at > self.window) or (at - incident.first_at > self.max_duration):
+                        continue
+                    distance = haversine_km(lat, lon, incident.lat, incident.lon)
+                    if distance <= self.radius_km:
+                        found.append((distance, incident))
+        return found
+
+    def _index(self, incident: OpenIncident):
+        cell = cell_for(incident.lat, incident.lon)
+        if cell != incident.cell:
+            self._unindex(incident)
+            self.by_cell.setdefault(cell, set()).add(incident)
+            incident.cell = cell
+
+    def _unindex(self, incident: OpenIncident):
+        incidents = self.by_cell.get(incident.cell)
+        if incidents is not None:
+            incidents.discard(incident)
+            if not incidents:
+                del self.by_cell[incident.cell]
+        incident.cell = None
+
+    def _record(self, incident: OpenIncident, lat: float, lon: float, count: int, severity: int, at: datetime):
+        add_change(self.changes, incident.id, {"new": not incident.written, "first_ref": incident.first_ref,
+            "first_at": incident.first_at, "count": count, "lat_sum": lat * count, "lon_sum": lon * count,
+            "severity": severity, "last_at": at})
+
+    # it returns the surviving incident
+    def _merge(self, a: OpenIncident, b: OpenIncident) -> OpenIncident:
+        source, target = (a, b) if (a.count, b.first_at) < (b.count, a.first_at) else (b, a)
+        target.add(source.lat, source.lon, source.count, source.severity, source.first_at, source.last_at)
+        if source.written: # the database adds the stored counters of the source (other workers' alerts too)
+            self.merges.append((source.id, target.id))
+        else: # only alerts of this worker, inserted as merged (its id was given to the clients)
+            self._record(target, source.lat, source.lon, source.count, source.severity, source.last_at)
+            if source.id in self.changes:
+                self.changes[source.id]["merged_into"] = target.id
+        self._forget(source)
+        self._rename(source.id, target.id)
+        self._index(target)
+        self.merged += 1
+        return target
+
+    def _forget(self, incident: OpenIncident):
+        self._unindex(incident)
+        self.incidents.pop(incident.id, None)
+
+    def _rename(self, old_id: uuid_pkg.UUID, new_id: uuid_pkg.UUID):
+        self.renamed[old_id] = new_id
+
+    # the current id of an incident (the chain is shortened as it's walked)
+    def _resolve(self, incident_id):
+        root = incident_id
+        while root in self.renamed:
+            root = self.renamed[root]
+        while incident_id != root:
+            self.renamed[incident_id], incident_id = root, self.renamed[incident_id]
+        return root
+
+    def _apply_renames(self, changes: dict, merges: list[tuple], alerts: list[dict]):
+        if not self.renamed:
+            return
+        for change in changes.values():
+            if change.get("merged_into") is not None:
+                change["merged_into"] = self._resolve(change["merged_into"])
+        merges[:] = [(source, self._resolve(target)) for source, target in merges]
+        for alert in alerts:
+            alert["incident_id"] = self._resolve(alert["incident_id"])
+
+    def expire(self, now: datetime):
+        for incident in [i for i in self.incidents.values() if now - i.last_at > self.window]:
+            self._forget(incident)
+            self.expired += 1
+
+    # It writes the changes in the session of the alerts batch (before the alerts, the
+    # foreign keys), and it replaces the ids of merged incidents in the buffered alerts.
+    # It returns what was taken, for restore() if the transaction fails.
+    async def write(self, db_session, alerts: list[dict]):
+        self.expire(now_tz_naive())
+        changes, self.changes = self.changes, {}
+        merges, self.merges = self.merges, []
+        for incident_id, change in changes.items():
+            if change["new"] and (incident_id in self.incidents):
+                self.incidents[incident_id].written = True
+        taken = (changes, merges)
+        try:
+            await self._adopt(db_session, changes)
+            self._apply_renames(changes, merges, [])
+            followed = await write_changes(db_session, changes, merges, self.incidents)
+            for old_id, survivor in followed.items():
+                self._follow(old_id, survivor)
+        except BaseException:
+            self.restore(taken)
+            raise
+        # once per flush: every id still in memory is replaced
+        self._apply_renames(self.changes, self.merges, alerts)
+        self.renamed.clear()
+        return taken
+
+    def restore(self, taken: tuple):
+        changes, merges = taken
+        for incident_id, change in changes.items():
+            incident = self.incidents.get(incident_id)
+            if change["new"] and (incident is not None):
+                incident.written = False
+            add_change(self.changes, incident_id, change)
+        self.merges[:0] = merges
+
+    # A new incident near an open incident of another worker (about the same event)
+    # becomes that incident
+    async def _adopt(self, db_session, changes: dict):
+        new_incidents = [self.incidents[i] for i, change in changes.items()
+            if change["new"] and (i in self.incidents)]
+        for first in range(0, len(new_incidents), ADOPT_CHUNK):
+            chunk = new_incidents[first:first + ADOPT_CHUNK]
+            oldest = min(incident.first_at for incident in chunk)
+            q = select(Incident).where(
+                or_(*(near_condition(i.lat, i.lon, self.radius_km, Incident.gps_cell) for i in chunk)) &
+                col(Incident.merged_into).is_(None) &
+                (col(Incident.last_alert_at) >= oldest - self.window) &
+                col(Incident.id).not_in([i.id for i in chunk]))
+            others = [other for other in (await db_session.exec(q)).all() if other.id not in self.incidents]
+            for incident in chunk:
+                nearest = None
+                for other in others:
+                    if (incident.first_at - other.last_alert_at > self.window) or (
+                            incident.last_at - other.first_alert_at > self.max_duration):
+                        continue
+                    distance = haversine_km(incident.lat, incident.lon, other.gps_lat, other.gps_lon)
+                    if (distance <= self.radius_km) and ((nearest is None) or (distance < nearest[0])):
+                        nearest = (distance, other)
+                if nearest is not None:
+                    self._take_over(incident, nearest[1], changes)
+
+    def _take_over(self, incident: OpenIncident, other: Incident, changes: dict):
+        old_id = incident.id
+        self._forget(incident)
+        incident.add(other.gps_lat, other.gps_lon, other.alert_count, other.max_severity,
+            other.first_alert_at, other.last_alert_at)
+        incident.id = other.id
+        incident.first_ref = other.first_alert_ref # the other worker notified it
+        self.incidents[incident.id] = incident
+        self._index(incident)
+        change = changes.pop(old_id)
+        changes[incident.id] = dict(change, new=False)
+        # inserted as merged: its id was given to the clients
+        changes[old_id] = dict(change, merged_into=incident.id)
+        if old_id in self.changes: # alerts accepted meanwhile
+            self.changes[incident.id] = self.changes.pop(old_id)
+            self.changes[incident.id]["new"] = False
+        self._rename(old_id, incident.id)
+        self.adopted += 1
+
+    # An incident merged by another worker is replaced by the surviving one (write_changes
+    # moved the increments there), so the next alerts and increments go there
+    def _follow(self, old_id: uuid_pkg.UUID, survivor: Incident):
+        incident = self.incidents.get(old_id)
+        if incident is not None:
+            self._forget(incident)
+            if survivor.id not in self.incidents:
+                incident.id = survivor.id
+                incident.first_ref = survivor.first_alert_ref
+                incident.lat, incident.lon = survivor.gps_lat, survivor.gps_lon
+                incident.count, incident.severity = survivor.alert_count, survivor.max_severity
+                incident.first_at, incident.last_at = survivor.first_alert_at, survivor.last_alert_at
+                incident.written = True
+                self.incidents[incident.id] = incident
+                self._index(incident)
+        if old_id in self.changes: # alerts accepted meanwhile
+            change = self.changes.pop(old_id)
+            change["new"] = False
+            add_change(self.changes, survivor.id, change)
+        self._rename(old_id, survivor.id)
+        self.followed += 1
+
+    def stats(self) -> dict:
+        return {
+            "open": len(self.incidents),
+            "alerts": self.alerts,
+            "opened": self.opened,
+            "merged": self.merged,
+            "adopted": self.adopted,
+            "followed": self.followed,
+            "expired": self.expired
+        }
+
+def add_change(changes: dict, incident_id: uuid_pkg.UUID, change: dict):
+    current = changes.get(incident_id)
+    if current is None:
+        changes[incident_id] = dict(change) # the taken changes stay as they were, for restore()
+        return
+    current["new"] = current["new"] or change["new"]
+    if change.get("merged_into") is not None:
+        current["merged_into"] = change["merged_into"]
+    current["first_at"] = min(current["first_at"], change["first_at"])
+    current["count"] += change["count"]
+    current["lat_sum"] += change["lat_sum"]
+    current["lon_sum"] += change["lon_sum"]
+    current["severity"] = max(current["severity"], change["severity"])
+    current["last_at"] = max(current["last_at"], change["last_at"])
+
+def insert_incidents(db_session):
+    dialect = postgresql if db_session.bind.dialect.name == "postgresql" else sqlite
+    # a row already written (a retried batch) is kept as it is
+    return dialect.insert(incidents_table).on_conflict_do_nothing(index_elements=["id"])
+
+# Counters are incremented (never recomputed from the alerts), so the workers don't overwrite
+# each other: the centroid is the weighted mean of the stored one and the new alerts.
+# - a merge marks the absorbed row (it's locked until the commit), then it adds its stored
+#   counters to the surviving row and it moves its alerts
+# - increments apply only to rows not merged: the ones merged (by another worker, or by a merge
+#   above) are sent to the surviving row, at most MAX_MERGE_HOPS times
+# It returns the incidents followed (merged id -> surviving row).
+async def write_changes(db_session, changes: dict, merges: list[tuple], incidents: dict) -> dict:
+    new_rows = []
+    increments = {}
+    for incident_id, change in changes.items():
+        if not change["new"]:
+            add_change(increments, incident_id, change)
+        elif change["count"] > 0: # else its alerts were discarded
+            lat = change["lat_sum"] / change["count"]
+            lon = change["lon_sum"] / change["count"]
+            new_rows.append({"id": incident_id, "first_alert_ref": change["first_ref"],
+                "gps_lat": lat, "gps_lon": lon, "gps_cell": cell_for(lat, lon),
+                "alert_count": change["count"], "max_severity": change["severity"],
+                "first_alert_at": change["first_at"], "last_alert_at": change["last_at"],
+                "merged_into": change.get("merged_into")})
+    if new_rows:
+        await db_session.exec(insert_incidents(db_session), params=new_rows)
+    t = incidents_table.c
+    for source, target in merges:
+        q = update(incidents_table).where((t.id == source) & t.merged_into.is_(None)).values(
+            merged_into=target).returning(t.alert_count, t.gps_lat, t.gps_lon, t.max_severity,
+                t.first_alert_at, t.last_alert_at)
+        row = (await db_session.exec(q)).first()
+        if row is None:
+            continue # merged meanwhile by another worker: its alerts and counters are there
+        await db_session.exec(update(incidents_table).where(t.merged_into == source).values(merged_into=target))
+        await db_session.exec(update(alerts_table).where(alerts_table.c.incident_id == source).values(
+            incident_id=target))
+        count, lat, lon, severity, first_at, last_at = row
+        if count > 0:
+            add_change(increments, target, {"new": False, "first_ref": None, "first_at": first_at,
+                "count": count, "lat_sum": lat * count, "lon_sum": lon * count, "severity": severity,
+                "last_at": last_at})
+    followed = {}
+    merged = aliased(Incident)
+    for _ in range(MAX_MERGE_HOPS):
+        if not increments:
+            break
+        await increment_incidents(db_session, increments, incidents)
+        ids = list(increments)
+        redirected = {}
+        for first in range(0, len(ids), ADOPT_CHUNK):
+            q = select(merged.id, Incident).join(Incident, Incident.id == merged.merged_into).where(
+                col(merged.id).in_(ids[first:first + ADOPT_CHUNK]))
+            for old_id, survivor in (await db_session.exec(q)).all():
+                followed[old_id] = survivor
+                add_change(redirected, survivor.id, increments[old_id])
+        increments = redirected
+    return followed
+
+async def increment_incidents(db_session, increments: dict, incidents: dict):
+    rows = []
+    for incident_id, change in increments.items():
+        # the cell follows the centroid known here (it moves little, within radius_km)
+        incident = incidents.get(incident_id)
+        if incident is not None:
+            cell = cell_for(incident.lat, incident.lon)
+        elif change["count"] > 0:
+            cell = cell_for(change["lat_sum"] / change["count"], change["lon_sum"] / change["count"])
+        else:
+            cell = None
+        rows.append({"b_id": incident_id, "b_count": change["count"], "b_lat_sum": change["lat_sum"],
+            "b_lon_sum": change["lon_sum"], "b_cell": cell, "b_severity": change["severity"],
+            "b_first": change["first_at"], "b_at": change["last_at"]})
+    t = incidents_table.c
+    total = t.alert_count + bindparam("b_count")
+    q = update(incidents_table).where((t.id == bindparam("b_id")) & t.merged_into.is_(None)).values(
+        gps_lat=case((total > 0, (t.gps_lat * t.alert_count + bindparam("b_lat_sum")) / total), else_=t.gps_lat),
+        gps_lon=case((total > 0, (t.gps_lon * t.alert_count + bindparam("b_lon_sum")) / total), else_=t.gps_lon),
+        gps_cell=func.coalesce(bindparam("b_cell"), t.gps_cell),
+        alert_count=total,
+        max_severity=case((t.max_severity < bindparam("b_severity"), bindparam("b_severity")),
+            else_=t.max_severity),
+        first_alert_at=case((t.first_alert_at > bindparam("b_first"), bindparam("b_first")),
+            else_=t.first_alert_at),
+        last_alert_at=case((t.last_alert_at < bindparam("b_at"), bindparam("b_at")),
+            else_=t.last_alert_at))
+    await db_session.exec(q, params=rows)
+
+# The incident an id ended in: merged incidents are followed to the surviving one
+async def get_surviving_incident(db_session, incident_id: uuid_pkg.UUID) -> Incident | None:
+    incident = await db_session.get(Incident, incident_id)
+    for _ in range(MAX_MERGE_HOPS):
+        if (incident is None) or (incident.merged_into is None):
+            break
+        incident = await db_session.get(Incident, incident.merged_into)
+    return incident
@@ -2,7 +2,8 @@
 # Copyright (C) 2025  Davide Quirillo
 # Licensed under the GNU GPL v3 or later. See LICENSE for details.
 
-from models.general import UserLanguage
+from string import Template
+from models.general import UserLanguage, MailKind
 from services.security import OTP_CODE_TTL_MINUTES
 
 langmap = {
@@ -38,117 +39,172 @@ langmap = {
     }
 }
 
-def localize_activation_mail(activation_url: str, lang: str):
-    if (lang == UserLanguage.it):
-        return f"""Ciao, 
-        
-per attivare il tuo account clicca sul seguente link:
-
-{activation_url}
-
-Se non hai richiesto questa registrazione, puoi ignorare questa email.
-"""
-    else: 
-        return f"""Hello, 
+# Mail bodies by language and mail kind: adding a language only needs a new entry here
+# (and in langmap). $name placeholders are filled at send time, except $ttl which is
+# a constant filled when templates are compiled.
+mail_templates = {
+    "en": {
+        "activation": """Hello, 
 
 to activate your account click on the following link:
 
-{activation_url}
+$activation_url
 
 If you haven't asked this mail message, you can ignore it.
-"""
-    
-def localize_reset_code_mail(code: str, lang: str):
-    if (lang == UserLanguage.it):
-        return f"""Ciao,
+""",
+        "reset_code": """Hello, 
+        
+you have requested a reset of your password.
 
-hai richiesto il reset della password.
+Your verification code is:
 
-Il tuo codice di verifica è:
+$code
 
-{code}
+This code is valid for $ttl minutes.
+If you haven't asked the reset, you can ignore this message.
+""",
+        "reset_successful": """Hello, 
+        
+you have changed your password successfully.
 
-Questo codice è valido per {OTP_CODE_TTL_MINUTES} minuti.
-Se non hai richiesto tu il reset, puoi ignorare questo messaggio.
-"""
-    else: 
-        return f"""Hello, 
+If it wasn't you, we recommend to do a new password reset immediately (in the app, login page, "forgot password").
+
+If the problem persists, please contact the competent territorial authority
+""",
+        "login_successful": """Hello,
+
+you have logged in successfully.
+
+If it wasn't you, we recommend to change your password immediately (in the app, login page, "forgot password").
+
+If the problem persists, please contact the competent territorial authority.
+""",
+        "login_code": """Hello, 
         
-you have requested a reset of your password.
+To complete the login, enter the verification code.
 
 Your verification code is:
 
-{code}
+$code
 
-This code is valid for {OTP_CODE_TTL_MINUTES} minutes.
-If you haven't asked the reset, you can ignore this message.
+This code is valid for $ttl minutes.
+If you haven't asked the login, we recommend to change your password immediately (in the app, login page, "forgot password").
 """
-    
-def localize_reset_successful_mail(lang: str):
-    if (lang == UserLanguage.it):
-        return f"""Ciao,
+    },
+    "it": {
+        "activation": """Ciao, 
+        
+per attivare il tuo account clicca sul seguente link:
 
-hai modificato la password con successo.
+$activation_url
 
-Se non sei stato tu, si raccomanda di effettuare al più presto un nuovo reset della password (nell'app, schermata di login, "password dimenticata").
+Se non hai richiesto questa registrazione, puoi ignorare questa email.
+""",
+        "reset_code": """Ciao,
 
-Se il problema persiste, contattare l'autorità territoriale competente.
-"""
-    else: 
-        return f"""Hello, 
-        
-you have changed your password successfully.
+hai richiesto il reset della password.
 
-If it wasn't you, we recommend to do a new password reset immediately (in the app, login page, "forgot password").
+Il tuo codice di verifica è:
 
-If the problem persists, please contact the competent territorial authority
-"""
-    
-def localize_login_successful_mail(lang: str):
-    if (lang == UserLanguage.it):
-        return f"""Ciao,
+$code
 
-hai effettuato l'accesso (login) con successo.
+Questo codice è valido per $ttl minuti.
+Se non hai richiesto tu il reset, puoi ignorare questo messaggio.
+""",
+        "reset_successful": """Ciao,
 
-Se non sei stato tu, si raccomanda di modificare al più presto la password (nell'app, schermata di login, "password dimenticata").
+hai modificato la password con successo.
 
-Se il problema persiste, contattare l'autorità territoriale competente.
-"""
-    else: 
-        return f"""Hello,
+Se non sei stato tu, si raccomanda di effettuare al più presto un nuovo reset della password (nell'app, schermata di login, "password dimenticata").
 
-you have logged in successfully.
+Se il problema persiste, contattare l'autorità territoriale competente.
+""",
+        "login_successful": """Ciao,
 
-If it wasn't you, we recommend to change your password immediately (in the app, login page, "forgot password").
+hai effettuato l'accesso (login) con successo.
 
-If the problem persists, please contact the competent territorial authority.
-"""
+Se non sei stato tu, si raccomanda di modificare al più presto la password (nell'app, schermata di login, "password dimenticata").
 
-def localize_login_code_mail(code: str, lang: str):
-    if (lang == UserLanguage.it):
-        return f"""Ciao,
+Se il problema persiste, contattare l'autorità territoriale competente.
+""",
+        "login_code": """Ciao,
 
 Per completare l'accesso (login), inserisci il codice di verifica.
 
 Il tuo codice di verifica è:
 
-{code}
+$code
 
-Questo codice è valido per {OTP_CODE_TTL_MINUTES} minuti.
+Questo codice è valido per $ttl minuti.
 Se non hai richiesto tu l'accesso (login), ti raccomandiamo di modificare al più presto la password (nell'app, schermata di login, "password dimenticata").
 """
-    else: 
-        return f"""Hello, 
-        
-To complete the login, enter the verification code.
+    }
+}
 
-Your verification code is:
+# subject (langmap key) of each mail kind
+mail_subjects = {
+    MailKind.activation: "reg_subject",
+    MailKind.reset_code: "reset_code_subject",
+    MailKind.reset_successful: "reset_done_subject",
+    MailKind.login_successful: "login_successful_subject",
+    MailKind.login_code: "login_code_subject"
+}
 
-{code}
+# A template split once into literal parts and placeholder names (constants are
+# folded into the literals), so rendering is a single join of the variable parts
+class MailTemplate:
+    __slots__ = ("subject", "literals", "names")
+
+    def __init__(self, subject: str, text: str, constants: dict):
+        self.subject = subject
+        self.literals = []
+        self.names = []
+        chunks = []
+        pos = 0
+        for m in Template.pattern.finditer(text):
+            chunks.append(text[pos:m.start()])
+            pos = m.end()
+            if m.group("escaped") is not None:
+                chunks.append("$")
+                continue
+            name = m.group("named") or m.group("braced")
+            if name is None:
+                raise ValueError(f"Invalid placeholder in mail template at {m.start()}")
+            if name in constants:
+                chunks.append(str(constants[name]))
+                continue
+            self.literals.append("".join(chunks))
+            self.names.append(name)
+            chunks = []
+        chunks.append(text[pos:])
+        self.literals.append("".join(chunks))
+
+    def render(self, values: dict) -> str:
+        parts = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            parts.append(str(values[name]))
+            parts.append(literal)
+        return "".join(parts)
+
+def compile_mail_templates() -> dict:
+    registry = {}
+    constants = {"ttl": OTP_CODE_TTL_MINUTES}
+    for lang, templates in mail_templates.items():
+        for name, text in templates.items():
+            kind = MailKind(name)
+            subject = langmap[lang][mail_subjects[kind]]
+            registry[(kind, lang)] = MailTemplate(subject, text, constants)
+    return registry
+
+mail_registry = compile_mail_templates()
+
+# kind can be the value read from the mail outbox
+def get_mail_template(kind: MailKind | str, lang: str) -> MailTemplate:
+    kind = MailKind(kind)
+    template = mail_registry.get((kind, lang))
+    if template is None: # language without translation
+        template = mail_registry[(kind, UserLanguage.en.value)]
+    return template
 
-This code is valid for {OTP_CODE_TTL_MINUTES} minutes.
-If you haven't asked the login, we recommend to change your password immediately (in the app, login page, "forgot password").
-"""
-    
 def localize_empty_string(): # I'm including this for visual convenience.
     return ""
@@ -0,0 +1,120 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import asyncio
+import logging
+import time
+import uuid as uuid_pkg
+from datetime import datetime
+from sqlalchemy import Float, Integer, DateTime, Uuid, bindparam, column, values
+from sqlmodel import update, or_
+from core.dbmgr import get_async_session
+from core.metrics import get_histogram
+from models.general import User
+from services.geo import cell_for
+
+logger = logging.getLogger("locations")
+
+users_table = User.__table__
+
+# Clients send their position often: the latest one of every user is kept in memory and
+# all of them are written together (one bulk UPDATE every "flush_seconds", or sooner when
+# "batch_size" users are waiting), instead of one UPDATE of the users row per request.
+# Positions still in memory are lost if the process crashes (at most "flush_seconds").
+class LocationBuffer:
+    def __init__(self, max_size: int, batch_size: int, flush_seconds: float):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.positions: dict[uuid_pkg.UUID, tuple] = {} # user id -> (lat, lon, cell, updated_at)
+        self.received = 0
+        self.coalesced = 0 # positions replaced by a newer one before the flush
+        self.rejected = 0
+        self.written = 0
+        self.failures = 0
+        self.flush_histogram = get_histogram("location_flush_seconds")
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    # it returns False if the buffer is full
+    def update(self, user_id: uuid_pkg.UUID, lat: float, lon: float, updated_at: datetime) -> bool:
+        if user_id in self.positions:
+            self.coalesced += 1
+        elif len(self.positions) >= self.max_size:
+            self.rejected += 1
+            return False
+        self.positions[user_id] = (lat, lon, cell_for(lat, lon), updated_at)
+        self.received += 1
+        if len(self.positions) >= self.batch_size:
+            self._batch_ready.set()
+        return True
+
+    async def flush(self, engine):
+        async with self._flush_lock:
+            if not self.positions:
+                return
+            pending, self.positions = self.positions, {}
+            rows = [{"b_id": user_id, "b_lat": lat, "b_lon": lon, "b_cell": cell, "b_at": updated_at}
+                for user_id, (lat, lon, cell, updated_at) in pending.items()]
+            start = time.perf_counter()
+            try:
+                async for db_session in get_async_session(engine):
+                    for first in range(0, len(rows), self.batch_size):
+                        await write_positions(db_session, rows[first:first + self.batch_size])
+                    await db_session.commit()
+            except BaseException:
+                # back in the buffer, unless a newer position arrived meanwhile
+                for user_id, position in pending.items():
+                    self.positions.setdefault(user_id, position)
+                raise
+            self.flush_histogram.observe(time.perf_counter() - start)
+            self.written += len(rows)
+
+    async def run(self, engine):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.flush(engine)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failures += 1
+                logger.exception(f"location flush failed, {len(self.positions)} positions waiting")
+                await asyncio.sleep(self.flush_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self.positions),
+            "max_queued": self.max_size,
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "written": self.written,
+            "failures": self.failures
+        }
+
+# Every server worker has its own buffer: a position older than the stored one is skipped
+# (timestamps have one second resolution, on a tie the last flush wins)
+def is_newer(updated_at):
+    return or_(users_table.c.gps_updated_at.is_(None), users_table.c.gps_updated_at <= updated_at)
+
+async def write_positions(db_session, rows: list[dict]):
+    if db_session.bind.dialect.name == "postgresql":
+        # UPDATE users SET ... FROM (VALUES (...), ...) AS v(...) WHERE users.id = v.id
+        v = values(column("b_id", Uuid), column("b_lat", Float), column("b_lon", Float),
+            column("b_cell", Integer), column("b_at", DateTime), name="v").data(
+                [(r["b_id"], r["b_lat"], r["b_lon"], r["b_cell"], r["b_at"]) for r in rows])
+        q = update(users_table).where((users_table.c.id == v.c.b_id) & is_newer(v.c.b_at)).values(
+            gps_lat=v.c.b_lat, gps_lon=v.c.b_lon, gps_cell=v.c.b_cell, gps_updated_at=v.c.b_at)
+        await db_session.exec(q)
+    else:
+        # other databases (sqlite): one statement, executed for every row
+        q = update(users_table).where((users_table.c.id == bindparam("b_id")) & is_newer(bindparam("b_at"))).values(
+            gps_lat=bindparam("b_lat"), gps_lon=bindparam("b_lon"), gps_cell=bindparam("b_cell"),
+            gps_updated_at=bindparam("b_at"))
+        await db_session.exec(q, params=rows)
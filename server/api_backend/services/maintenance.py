@@ -0,0 +1,45 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+from datetime import timedelta
+from sqlmodel import select, delete, func, desc, col
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.general import RefreshToken, User
+from services.security import now_tz_naive, REFRESH_TOKEN_TTL_MINUTES, MAX_ACTIVE_REFRESH_TOKENS
+
+# Deletes are done in chunks (one transaction each) to keep locks short
+async def delete_in_batches(db_session: AsyncSession, model, ids_query, batch_size: int) -> int:
+    total = 0
+    while True:
+        q = delete(model).where(col(model.id).in_(ids_query.limit(batch_size)))
+        result = await db_session.exec(q)
+        await db_session.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+
+async def purge_refresh_tokens(db_session: AsyncSession, batch_size: int) -> dict:
+    # a refresh token expires REFRESH_TOKEN_TTL_MINUTES after its last rotation
+    expired_before = now_tz_naive() - timedelta(minutes=REFRESH_TOKEN_TTL_MINUTES)
+    ids = select(RefreshToken.id).where(
+        (col(RefreshToken.is_revoked) == True) | 
+        (RefreshToken.updated_at < expired_before))
+    removed = await delete_in_batches(db_session, RefreshToken, ids, batch_size)
+    # tokens beyond the newest MAX_ACTIVE_REFRESH_TOKENS of each user
+    ranked = select(
+        RefreshToken.id,
+        func.row_number().over(
+            partition_by=RefreshToken.user_id, 
+            order_by=desc(RefreshToken.updated_at)).label("position")
+    ).subquery()
+    ids = select(ranked.c.id).where(ranked.c.position > MAX_ACTIVE_REFRESH_TOKENS)
+    surplus = await delete_in_batches(db_session, RefreshToken, ids, batch_size)
+    return {"expired_or_revoked": removed, "surplus": surplus}
+
+# Abandoned registrations (never activated, activation link expired)
+async def purge_expired_registrations(db_session: AsyncSession, batch_size: int) -> int:
+    ids = select(User.id).where(
+        (col(User.activation_expires_at) < now_tz_naive()) & 
+        (col(User.is_active) == False))
+    return await delete_in_batches(db_session, User, ids, batch_size)
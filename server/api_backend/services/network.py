@@ -3,59 +3,188 @@
 # Licensed under the GNU GPL v3 or later. See LICENSE for details.
 
 import smtplib
+import threading
+from urllib.parse import urlencode
+import time
+from collections import deque
+from email import policy
 from email.message import EmailMessage
 from core.settings import settings
-from services.localization import (langmap, 
-    localize_activation_mail, localize_reset_code_mail, 
-    localize_reset_successful_mail, 
-    localize_login_successful_mail,
-    localize_login_code_mail
-    )
+from core.metrics import get_histogram
+from models.general import MailKind
+from services.localization import get_mail_template, mail_registry
 
-def send_mail_message(data):
-    with smtplib.SMTP(settings.smtp_host, settings.smtp_port) as server:
-        server.send_message(data)
-
-def send_activation_mail(email: str, token: str, lang: str):
-    prot = settings.protocol
-    sname = settings.server_name
-    sport = settings.server_port
-    act_url = f"{prot}://{sname}:{sport}/api/activate?email={email}&token={token}"
-    msg = EmailMessage()
-    msg["Subject"] = langmap[lang]["reg_subject"]
-    msg["From"] = settings.smtp_from
-    msg["To"] = email
-    msg.set_content(localize_activation_mail(act_url, lang))     
-    send_mail_message(msg)
+# A small pool of persistent SMTP connections: a message batch is sent over
+# a single connection, and a connection broken by the relay is replaced once
+class SMTPConnectionPool:
+    def __init__(self, host: str, port: int, size: int, timeout: int, idle_seconds: int):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self._idle = deque() # (connection, last used time)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.latency = get_histogram("mail_send_seconds")
+        self.connects = 0
+        self.reconnects = 0
+        self.sent = 0
+        self.failed = 0
 
-def send_reset_code_mail(email: str, code: str, lang: str):
-    msg = EmailMessage()
-    msg["Subject"] = langmap[lang]["reset_code_subject"]
-    msg["From"] = settings.smtp_from
-    msg["To"] = email
-    msg.set_content(localize_reset_code_mail(code, lang))     
-    send_mail_message(msg)
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        with self._lock:
+            self.connects += 1
+        return conn
 
-def send_reset_successful_mail(email: str, lang: str):
-    msg = EmailMessage()
-    msg["Subject"] = langmap[lang]["reset_done_subject"]
-    msg["From"] = settings.smtp_from
-    msg["To"] = email
-    msg.set_content(localize_reset_successful_mail(lang))     
-    send_mail_message(msg)
+    def _discard(self, conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
 
-def send_login_successful_mail(email: str, lang: str):
-    msg = EmailMessage()
-    msg["Subject"] = langmap[lang]["login_successful_subject"]
-    msg["From"] = settings.smtp_from
-    msg["To"] = email
-    msg.set_content(localize_login_successful_mail(lang))
-    send_mail_message(msg)
+    def _acquire(self) -> smtplib.SMTP:
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return self._connect()
+                conn, last_used = item
+                if (time.monotonic() - last_used) < self.idle_seconds:
+                    return conn
+                self._discard(conn) # the relay has probably closed it
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn: smtplib.SMTP | None):
+        if conn is not None:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        self._slots.release()
+
+    # It returns the connection for the next message (None if broken) and the error
+    def _send(self, conn: smtplib.SMTP, msg) -> tuple:
+        try:
+            conn.send_message(msg)
+            return (conn, None)
+        except smtplib.SMTPServerDisconnected:
+            self._discard(conn)
+        except smtplib.SMTPException as e:
+            return (conn, e) # message refused, but the connection is still usable
+        except OSError:
+            self._discard(conn)
+        try: # the connection was broken (relay restart, idle timeout...), we retry once
+            conn = None
+            conn = self._connect()
+            with self._lock:
+                self.reconnects += 1
+            conn.send_message(msg)
+            return (conn, None)
+        except smtplib.SMTPServerDisconnected as e:
+            return (None, e)
+        except smtplib.SMTPException as e:
+            return (conn, e)
+        except OSError as e:
+            if conn is not None:
+                self._discard(conn)
+            return (None, e)
+
+    # It returns the error of each message (None if sent)
+    def send_messages(self, messages: list) -> list:
+        try:
+            conn = self._acquire()
+        except (smtplib.SMTPException, OSError) as e:
+            with self._lock:
+                self.failed += len(messages)
+            return [e] * len(messages)
+        errors = []
+        try:
+            for msg in messages:
+                if conn is None: # the relay is unreachable, we skip the rest of the batch
+                    error = errors[-1]
+                else:
+                    start = time.perf_counter()
+                    conn, error = self._send(conn, msg)
+                    if error is None:
+                        self.latency.observe(time.perf_counter() - start)
+                with self._lock:
+                    if error is None:
+                        self.sent += 1
+                    else:
+                        self.failed += 1
+                errors.append(error)
+        finally:
+            self._release(conn)
+        return errors
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "connects": self.connects,
+                "reconnects": self.reconnects,
+                "sent": self.sent,
+                "failed": self.failed,
+                "latency_seconds": self.latency.snapshot()
+            }
+
+_mail_pool: SMTPConnectionPool | None = None
+_mail_pool_lock = threading.Lock()
+
+def get_mail_pool() -> SMTPConnectionPool:
+    global _mail_pool
+    with _mail_pool_lock:
+        if _mail_pool is None:
+            _mail_pool = SMTPConnectionPool(settings.smtp_host, settings.smtp_port,
+                settings.smtp_pool_size, settings.smtp_timeout, settings.smtp_idle_seconds)
+        return _mail_pool
+
+def close_mail_pool():
+    global _mail_pool
+    with _mail_pool_lock:
+        if _mail_pool is not None:
+            _mail_pool.close()
+            _mail_pool = None
+
+def send_mail_messages(messages: list) -> list:
+    return get_mail_pool().send_messages(messages)
+
+def send_mail_message(data):
+    error = send_mail_messages([data])[0]
+    if error is not None:
+        raise error
+
+# constant part of the activation link, computed once
+activation_base_url = (f"{settings.protocol}://{settings.server_name}:"
+    f"{settings.server_port}/api/activate?")
+
+# Subject and From of every template, parsed (and encoded) once: a message gets them
+# as they are, only To and the body are set for every message
+mail_headers = {template: [policy.default.header_store_parse(name, value)
+    for name, value in (("Subject", template.subject), ("From", settings.smtp_from))]
+    for template in mail_registry.values()}
 
-def send_login_code_mail(email: str, code: str, lang: str):
+def build_mail(kind: MailKind | str, email: str, lang: str, code: str | None = None):
+    if kind == MailKind.activation:
+        values = {"activation_url": activation_base_url + urlencode({"email": email, "token": code})}
+    else:
+        values = {"code": code}
+    template = get_mail_template(kind, lang)
     msg = EmailMessage()
-    msg["Subject"] = langmap[lang]["login_code_subject"]
-    msg["From"] = settings.smtp_from
+    for name, value in mail_headers[template]:
+        msg.set_raw(name, value)
     msg["To"] = email
-    msg.set_content(localize_login_code_mail(code, lang))     
-    send_mail_message(msg)
\ No newline at end of file
+    msg.set_content(template.render(values))
+    return msg
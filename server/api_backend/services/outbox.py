@@ -0,0 +1,96 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+from datetime import timedelta
+from concurrent.futures import Executor
+from sqlmodel import Session, select, delete, func, col
+from sqlmodel.ext.asyncio.session import AsyncSession
+from core.settings import settings
+from models.general import MailOutbox, MailStatus
+from services.network import build_mail, send_mail_messages
+from services.security import now_tz_naive
+
+# The api writes mails in the outbox table, in the same transaction of the
+# user changes (the caller commits). The dispatcher process sends them.
+def enqueue_mail(db_session: Session | AsyncSession, kind: str, email: str, lang: str, code: str | None = None):
+    db_session.add(MailOutbox(kind=kind, email=email, language=lang, code=code))
+
+def retry_delay(attempts: int) -> timedelta:
+    seconds = settings.mail_retry_base_seconds * (2 ** (attempts - 1))
+    return timedelta(seconds=min(seconds, settings.mail_retry_max_seconds))
+
+def claim_mail_batch(db_session: Session, batch_size: int) -> list:
+    now = now_tz_naive()
+    q = select(MailOutbox).where(
+        (MailOutbox.status == MailStatus.pending) & 
+        (MailOutbox.next_attempt_at <= now)
+    ).order_by(MailOutbox.next_attempt_at).limit(batch_size).with_for_update(skip_locked=True)
+    records = db_session.exec(q).all()
+    # the lease hides the batch from other dispatchers, if we crash the mails become due again
+    lease_until = now + timedelta(seconds=settings.mail_claim_seconds)
+    for record in records:
+        record.next_attempt_at = lease_until
+        db_session.add(record)
+    db_session.commit()
+    return records
+
+def _send_chunk(records: list) -> list:
+    messages = []
+    errors = []
+    for record in records:
+        try:
+            messages.append(build_mail(record.kind, record.email, record.language, record.code))
+            errors.append(None)
+        except (ValueError, KeyError) as e: # unknown kind or language
+            errors.append(e)
+    results = iter(send_mail_messages(messages)) if messages else iter([])
+    return [e if e is not None else next(results) for e in errors]
+
+# It sends the records over "concurrency" smtp connections and returns the error of each one
+def send_outbox_mails(records: list, executor: Executor, concurrency: int) -> list:
+    chunk_size = max(1, -(-len(records) // concurrency))
+    chunks = [records[i:i + chunk_size] for i in range(0, len(records), chunk_size)]
+    futures = [executor.submit(_send_chunk, chunk) for chunk in chunks]
+    errors = []
+    for future in futures:
+        errors.extend(future.result())
+    return errors
+
+def record_mail_results(db_session: Session, records: list, errors: list) -> dict:
+    now = now_tz_naive()
+    counts = {"sent": 0, "retry": 0, "failed": 0}
+    for record, error in zip(records, errors):
+        if error is None:
+            record.status = MailStatus.sent
+            record.sent_at = now
+            record.code = None
+            counts["sent"] += 1
+        else:
+            record.attempts += 1
+            record.last_error = str(error)[:256]
+            if record.attempts >= settings.mail_max_attempts:
+                record.status = MailStatus.failed
+                record.code = None
+                counts["failed"] += 1
+            else:
+                record.next_attempt_at = now + retry_delay(record.attempts)
+                counts["retry"] += 1
+        db_session.add(record)
+    db_session.commit()
+    return counts
+
+def purge_sent_mails(db_session: Session, batch_size: int) -> int:
+    older_than = now_tz_naive() - timedelta(hours=settings.mail_outbox_retention_hours)
+    ids = select(MailOutbox.id).where(
+        (MailOutbox.status == MailStatus.sent) & 
+        (col(MailOutbox.sent_at) < older_than)
+    ).limit(batch_size)
+    result = db_session.exec(delete(MailOutbox).where(col(MailOutbox.id).in_(ids)))
+    db_session.commit()
+    return result.rowcount
+
+async def get_outbox_stats(db_session: AsyncSession) -> dict:
+    q = select(MailOutbox.status, func.count()).group_by(MailOutbox.status)
+    rows = (await db_session.exec(q)).all()
+    return {status: count for status, count in rows}
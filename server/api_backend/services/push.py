@@ -0,0 +1,202 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+import httpx
+from sqlmodel import select, col, tuple_
+from core.settings import settings
+from core.dbmgr import get_async_session
+from core.metrics import get_histogram
+from models.general import User, UserStatus
+from services.geo import cell_ranges, haversine_km
+
+logger = logging.getLogger("push")
+
+# A push gateway delivers a list of messages ({"to": user id, "data": {...}}):
+# the gateway maps users to their devices (FCM, APNs, ...)
+class PushGateway(ABC):
+    @abstractmethod
+    async def send(self, messages: list[dict]):
+        pass
+
+    async def close(self):
+        pass
+
+class HttpPushGateway(PushGateway):
+    def __init__(self, url: str, token: str, max_in_flight: int, timeout: float):
+        self.url = url
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.client = httpx.AsyncClient(timeout=timeout,
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight))
+
+    async def send(self, messages: list[dict]):
+        for attempt in range(2): # one retry, for dropped connections and 5xx answers
+            try:
+                response = await self.client.post(self.url, json={"messages": messages}, headers=self.headers)
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    return
+                error = httpx.HTTPStatusError(f"push gateway answered {response.status_code}",
+                    request=response.request, response=response)
+            except httpx.TransportError as e:
+                error = e
+        raise error
+
+    async def close(self):
+        await self.client.aclose()
+
+# Recipients as (user id, distance_km) lists of about "chunk_size" users. Every chunk is read
+# in its own short session, after the last (gps_cell, id) read, one cell range at a time (an
+# index range of users(gps_cell, id)): the connection goes back to the pool while the gateway
+# requests wait for a slot, so a slow gateway doesn't drain the database pool.
+async def resolve_recipients(engine, lat: float, lon: float, radius_km: float, chunk_size: int,
+        user_types: list[str] | None = None, officials_only: bool = False, chiefs_only: bool = False,
+        exclude_user_id=None):
+    q = select(User.id, User.gps_lat, User.gps_lon, User.gps_cell).where(
+        (col(User.is_active) == True) &
+        (User.status != UserStatus.blocked))
+    if user_types:
+        q = q.where(col(User.type).in_(user_types))
+    if officials_only:
+        q = q.where(col(User.is_official) == True)
+    if chiefs_only:
+        q = q.where(col(User.is_chief) == True)
+    if exclude_user_id is not None:
+        q = q.where(User.id != exclude_user_id)
+    chunk = []
+    for first, last in cell_ranges(lat, lon, radius_km):
+        range_q = q.where(col(User.gps_cell).between(first, last)).order_by(User.gps_cell, User.id)
+        after = None
+        while True:
+            chunk_q = range_q if after is None else range_q.where(tuple_(User.gps_cell, User.id) > tuple_(*after))
+            async for db_session in get_async_session(engine):
+                rows = (await db_session.exec(chunk_q.limit(chunk_size))).all()
+            for user_id, user_lat, user_lon, _ in rows:
+                distance = haversine_km(lat, lon, user_lat, user_lon)
+                if distance <= radius_km:
+                    chunk.append((user_id, distance))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+            if len(rows) < chunk_size:
+                break
+            after = (rows[-1][3], rows[-1][0])
+    if chunk:
+        yield chunk
+
+def build_push_message(alert: dict, user_id, distance_km: float) -> dict:
+    return {
+        "to": str(user_id),
+        "data": {
+            "type": "alert",
+            "ref": str(alert["ref"]),
+            "incident_id": str(alert["incident_id"]) if alert.get("incident_id") else None,
+            "severity": alert["severity"],
+            "description": alert["description"],
+            "gps_lat": alert["gps_lat"],
+            "gps_lon": alert["gps_lon"],
+            "distance_km": round(distance_km, 1)
+        }
+    }
+
+# The recipient policy: everybody active within PUSH_RADIUS_KM, the officials (of
+# PUSH_OFFICIAL_TYPES, if any) within PUSH_OFFICIAL_RADIUS_KM (rescuers come from farther
+# away), the chiefs within PUSH_CHIEFS_RADIUS_KM (a pass is skipped if it's not wider)
+def recipient_passes() -> list[dict]:
+    passes = [{"radius_km": settings.push_radius_km}]
+    if settings.push_official_radius_km > settings.push_radius_km:
+        passes.append({"radius_km": settings.push_official_radius_km, "officials_only": True,
+            "user_types": settings.push_official_types})
+    if settings.push_chiefs_radius_km > max(settings.push_radius_km, settings.push_official_radius_km):
+        passes.append({"radius_km": settings.push_chiefs_radius_km, "officials_only": True,
+            "chiefs_only": True})
+    return passes
+
+# It sends the alert to the recipients of every pass (see recipient_passes). At most
+# "max_in_flight" gateway requests are pending: reading recipients waits for a free slot.
+async def fan_out_alert(engine, gateway: PushGateway, alert: dict, max_in_flight: int,
+        chunk_size: int) -> dict:
+    start = time.perf_counter()
+    slots = asyncio.Semaphore(max_in_flight)
+    pending = set()
+    counts = {"recipients": 0, "requests": 0, "failed": 0}
+
+    async def deliver(messages):
+        try:
+            await gateway.send(messages)
+        except Exception as e:
+            counts["failed"] += len(messages)
+            logger.warning(f"push delivery failed ref={alert['ref']} messages={len(messages)} error={e}")
+        finally:
+            slots.release()
+
+    sent_to = set() # users near the alert are found by more passes
+    for recipients_pass in recipient_passes():
+        chunks = resolve_recipients(engine, alert["gps_lat"], alert["gps_lon"], chunk_size=chunk_size,
+            exclude_user_id=alert["user_id"], **recipients_pass)
+        async for chunk in chunks:
+            messages = [build_push_message(alert, user_id, distance)
+                for user_id, distance in chunk if user_id not in sent_to]
+            sent_to.update(user_id for user_id, _ in chunk)
+            if not messages:
+                continue
+            await slots.acquire()
+            counts["recipients"] += len(messages)
+            counts["requests"] += 1
+            task = asyncio.create_task(deliver(messages))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.gather(*pending)
+    counts["seconds"] = round(time.perf_counter() - start, 3) # time to the last delivery
+    get_histogram("push_fanout_seconds").observe(counts["seconds"])
+    return counts
+
+# Accepted alerts wait here for the fan-out workers (bounded: when it's full,
+# the alert is not pushed and it's counted as dropped)
+class AlertFanOut:
+    def __init__(self, gateway: PushGateway, queue_size: int, max_in_flight: int, chunk_size: int):
+        self.gateway = gateway
+        self.max_in_flight = max_in_flight
+        self.chunk_size = chunk_size
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.alerts = 0
+        self.dropped = 0
+        self.recipients = 0
+        self.failed = 0
+
+    def submit(self, alerts: list[dict]):
+        for alert in alerts:
+            try:
+                self.queue.put_nowait(alert)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                logger.warning(f"push queue full, alert not pushed ref={alert['ref']}")
+
+    async def run(self, engine):
+        while True:
+            alert = await self.queue.get()
+            try:
+                counts = await fan_out_alert(engine, self.gateway, alert, self.max_in_flight, self.chunk_size)
+                self.alerts += 1
+                self.recipients += counts["recipients"]
+                self.failed += counts["failed"]
+                logger.info(f"alert_pushed ref={alert['ref']} recipients={counts['recipients']} "
+                    f"requests={counts['requests']} failed={counts['failed']} seconds={counts['seconds']}")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"push fan-out failed ref={alert['ref']}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "alerts": self.alerts,
+            "dropped": self.dropped,
+            "recipients": self.recipients,
+            "failed_deliveries": self.failed
+        }
@@ -0,0 +1,214 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import asyncio
+import time
+import uuid as uuid_pkg
+from collections import deque
+from sqlmodel import select, func, col, or_
+from core.dbmgr import get_async_session
+from models.general import Alert
+from services.geo import cell_for, cell_ranges, haversine_km
+
+# The messages waiting for one connection (websocket or server-sent events). It's bounded:
+# a slow client loses its oldest messages, and a message with a "key" replaces the waiting
+# one with the same key (for example the latest state of something), so an idle or slow
+# connection costs at most "max_size" messages of memory.
+class Subscriber:
+    def __init__(self, user_id: uuid_pkg.UUID, max_size: int):
+        self.user_id = user_id
+        self.max_size = max_size
+        self.lat = None
+        self.lon = None
+        self.cell = None
+        self.dropped = 0
+        self._messages = deque()
+        self._keys = {} # key -> waiting message (a dict, replaced in place)
+        self._ready = asyncio.Event()
+
+    def put(self, message: dict, key=None):
+        if key is not None and key in self._keys:
+            self._keys[key].clear()
+            self._keys[key].update(message)
+            return
+        if len(self._messages) >= self.max_size:
+            old_key, _ = self._messages.popleft()
+            self._keys.pop(old_key, None)
+            self.dropped += 1
+        message = dict(message)
+        self._messages.append((key, message))
+        if key is not None:
+            self._keys[key] = message
+        self._ready.set()
+
+    # the waiting messages (at least one), oldest first
+    async def get_all(self) -> list[dict]:
+        while not self._messages:
+            self._ready.clear()
+            await self._ready.wait()
+        messages = [message for _, message in self._messages]
+        self._messages.clear()
+        self._keys.clear()
+        if self.dropped:
+            messages.insert(0, {"type": "dropped", "count": self.dropped})
+            self.dropped = 0
+        return messages
+
+# Connected subscribers, indexed by user and by the grid cell of their position
+class Hub:
+    def __init__(self, radius_km: float, queue_size: int):
+        self.radius_km = radius_km
+        self.queue_size = queue_size
+        self.by_user: dict[uuid_pkg.UUID, set] = {}
+        self.by_cell: dict[int, set] = {}
+        self.connections = 0
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, user_id: uuid_pkg.UUID, lat: float | None = None, lon: float | None = None) -> Subscriber:
+        subscriber = Subscriber(user_id, self.queue_size)
+        self.by_user.setdefault(user_id, set()).add(subscriber)
+        self.connections += 1
+        if (lat is not None) and (lon is not None):
+            self.move(subscriber, lat, lon)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._remove_from_cell(subscriber)
+        subscribers = self.by_user.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.by_user[subscriber.user_id]
+        self.connections -= 1
+
+    def _remove_from_cell(self, subscriber: Subscriber):
+        subscribers = self.by_cell.get(subscriber.cell)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.by_cell[subscriber.cell]
+
+    def move(self, subscriber: Subscriber, lat: float, lon: float):
+        cell = cell_for(lat, lon)
+        if cell != subscriber.cell:
+            self._remove_from_cell(subscriber)
+            self.by_cell.setdefault(cell, set()).add(subscriber)
+            subscriber.cell = cell
+        subscriber.lat = lat
+        subscriber.lon = lon
+
+    def move_user(self, user_id: uuid_pkg.UUID, lat: float, lon: float):
+        for subscriber in self.by_user.get(user_id, ()):
+            self.move(subscriber, lat, lon)
+
+    def send_to_user(self, user_id: uuid_pkg.UUID, message: dict, key=None):
+        for subscriber in self.by_user.get(user_id, ()):
+            subscriber.put(message, key)
+            self.delivered += 1
+
+    # Every connected user within radius_km of the alert, but the author
+    def publish_alert(self, alert: dict, key=None):
+        lat, lon = alert["gps_lat"], alert["gps_lon"]
+        if (lat is None) or (lon is None):
+            return
+        self.published += 1
+        for first, last in cell_ranges(lat, lon, self.radius_km):
+            if last - first > len(self.by_cell): # faster to scan the occupied cells
+                cells = [c for c in self.by_cell if first <= c <= last]
+            else:
+                cells = range(first, last + 1)
+            for cell in cells:
+                for subscriber in self.by_cell.get(cell, ()):
+                    if subscriber.user_id == alert["user_id"]:
+                        continue
+                    distance = haversine_km(lat, lon, subscriber.lat, subscriber.lon)
+                    if distance <= self.radius_km:
+                        subscriber.put(alert_message(alert, distance), key)
+                        self.delivered += 1
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "users": len(self.by_user),
+            "cells": len(self.by_cell),
+            "published": self.published,
+            "delivered": self.delivered
+        }
+
+def alert_message(alert: dict, distance_km: float) -> dict:
+    return {
+        "type": "alert",
+        "ref": str(alert["ref"]),
+        "incident_id": str(alert["incident_id"]) if alert.get("incident_id") else None,
+        "severity": alert["severity"],
+        "description": alert["description"],
+        "gps_lat": alert["gps_lat"],
+        "gps_lon": alert["gps_lon"],
+        "created_at": alert["created_at"].isoformat(),
+        "distance_km": round(distance_km, 1)
+    }
+
+# To the author of an alert (on any server worker, every worker tails the alerts): the alert
+# is written, with its incident (the id answered when it was accepted can be a merged one)
+def alert_written_message(alert: dict) -> dict:
+    return {
+        "type": "alert_written",
+        "ref": str(alert["ref"]),
+        "incident_id": str(alert["incident_id"]) if alert.get("incident_id") else None,
+        "votes_up": alert["votes_up"],
+        "votes_down": alert["votes_down"]
+    }
+
+MAX_GAP = 1000
+
+# Alerts are written by every server worker: each worker reads the new rows of the alerts
+# table (by id, an index range) and publishes them to its own subscribers. Ids are assigned
+# before the commit, so a lower id can appear after a higher one: the missing ids are
+# looked for again during "gap_seconds". Only the first alert of an incident is published,
+# the following ones (during "incident_seconds") are about the same event.
+class AlertTail:
+    def __init__(self, hub: Hub, batch_size: int, gap_seconds: float, incident_seconds: float):
+        self.hub = hub
+        self.batch_size = batch_size
+        self.gap_seconds = gap_seconds
+        self.incident_seconds = incident_seconds
+        self.last_id = None
+        self.gaps: dict[int, float] = {} # missing id -> time it was noticed
+        self.incidents: dict = {} # published incident id -> time of its last alert
+
+    async def poll(self, engine):
+        async for db_session in get_async_session(engine):
+            if self.last_id is None: # we start from the newest alert
+                self.last_id = (await db_session.exec(select(func.max(Alert.id)))).one() or 0
+                return
+            now = time.monotonic()
+            self.gaps = {i: t for i, t in self.gaps.items() if now - t < self.gap_seconds}
+            self.incidents = {i: t for i, t in self.incidents.items() if now - t < self.incident_seconds}
+            while True:
+                condition = col(Alert.id) > self.last_id
+                if self.gaps:
+                    condition = or_(condition, col(Alert.id).in_(list(self.gaps)))
+                q = select(Alert).where(condition).order_by(Alert.id).limit(self.batch_size)
+                alerts = (await db_session.exec(q)).all()
+                new_rows = 0
+                for alert in alerts:
+                    if alert.id in self.gaps:
+                        del self.gaps[alert.id]
+                    elif alert.id > self.last_id:
+                        if alert.id - self.last_id <= MAX_GAP: # else ids were skipped (not pending)
+                            for missing in range(self.last_id + 1, alert.id):
+                                self.gaps[missing] = now
+                        self.last_id = alert.id
+                        new_rows += 1
+                    data = alert.model_dump()
+                    self.hub.send_to_user(alert.user_id, alert_written_message(data))
+                    if alert.incident_id is not None:
+                        published = alert.incident_id in self.incidents
+                        self.incidents[alert.incident_id] = now
+                        if published:
+                            continue
+                    self.hub.publish_alert(data)
+                if new_rows < self.batch_size:
+                    return
@@ -4,12 +4,17 @@
 
 from datetime import datetime, timezone, timedelta
 from typing import Optional
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import asyncio
+import time
 import jwt
 import bcrypt
 import secrets
 import hashlib
 import hmac
 from core.settings import settings
+from core.cache import TTLCache
+from core.metrics import get_histogram, register_gauge
 
 def now_tz_naive():
     return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
@@ -37,6 +42,68 @@ def check_password_against_hash(plain_password, hashed_password):
         bytes(hashed_password, encoding="utf-8"),
     )
 
+# bcrypt is slow on purpose (and it releases the GIL), so async code must not
+# call the functions above directly: we run them in a bounded worker pool.
+# Counters are only touched by the event loop thread, so they need no lock.
+_password_executor: Executor | None = None
+_password_jobs_pending = 0
+_password_jobs_completed = 0
+_password_queue_depth_peak = 0
+
+def get_password_executor() -> Executor:
+    global _password_executor
+    if _password_executor is None:
+        workers = settings.password_hash_workers
+        if settings.password_hash_executor == "process":
+            _password_executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            _password_executor = ThreadPoolExecutor(max_workers=workers, 
+                thread_name_prefix="password_hash")
+    return _password_executor
+
+def shutdown_password_executor():
+    global _password_executor
+    if _password_executor is not None:
+        _password_executor.shutdown(wait=True, cancel_futures=True)
+        _password_executor = None
+
+async def run_password_job(func, *args):
+    global _password_jobs_pending, _password_jobs_completed, _password_queue_depth_peak
+    loop = asyncio.get_running_loop()
+    histogram = get_histogram("password_hash_seconds", job=func.__name__)
+    start = time.perf_counter()
+    _password_jobs_pending += 1
+    queue_depth = _password_jobs_pending - settings.password_hash_workers
+    if queue_depth > _password_queue_depth_peak:
+        _password_queue_depth_peak = queue_depth
+    try:
+        return await loop.run_in_executor(get_password_executor(), func, *args)
+    finally:
+        _password_jobs_pending -= 1
+        _password_jobs_completed += 1
+        histogram.observe(time.perf_counter() - start) # queue wait included
+
+async def get_password_hash_async(password):
+    return await run_password_job(get_password_hash, password)
+
+async def check_password_against_hash_async(plain_password, hashed_password):
+    return await run_password_job(check_password_against_hash, 
+        plain_password, hashed_password)
+
+def get_password_pool_stats() -> dict:
+    workers = settings.password_hash_workers
+    return {
+        "executor": settings.password_hash_executor,
+        "size": workers,
+        "busy": min(_password_jobs_pending, workers),
+        "queue_depth": max(0, _password_jobs_pending - workers),
+        "queue_depth_peak": _password_queue_depth_peak,
+        "completed": _password_jobs_completed
+    }
+
+register_gauge("password_hash_queue_depth", 
+    lambda: max(0, _password_jobs_pending - settings.password_hash_workers))
+
 RANDOM_TOKEN_BYTES = 32
 ACTIVATION_TOKEN_BYTES = 32
 ACTIVATION_TOKEN_TTL_HOURS = 24
@@ -139,3 +206,25 @@ def decode_token(token):
     data = jwt.decode(token, settings.jwt_secret_key, 
         algorithms=[JWT_ALGORITHM])
     return data
+
+# Verified claims of the tokens, by token digest, until they expire:
+# clients reuse the same access token for many requests
+token_cache = TTLCache(settings.token_cache_max_entries, ACCESS_TOKEN_TTL_MINUTES * 60)
+
+jwt_decode_histogram = get_histogram("jwt_decode_seconds")
+
+def decode_token_cached(token):
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    data = token_cache.get(key)
+    if data is not None:
+        return data
+    start = time.perf_counter()
+    try:
+        data = decode_token(token) # it raises if the token is not valid or expired
+    finally:
+        jwt_decode_histogram.observe(time.perf_counter() - start)
+    exp = data.get("exp")
+    if isinstance(exp, (int, float)):
+        ttl = min(exp - time.time(), token_cache.ttl_seconds)
+        token_cache.set(key, data, ttl)
+    return data
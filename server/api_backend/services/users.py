@@ -0,0 +1,96 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import io
+import csv
+import json
+import base64
+import binascii
+import uuid as uuid_pkg
+from datetime import datetime
+from sqlmodel import select, col, tuple_
+from core.dbmgr import get_async_session
+from models.general import User
+
+# Users are listed in (created_at, id) order, an index range from the last row of the previous
+# page (keyset pagination): a page costs the same at the first row and at the millionth, where
+# LIMIT/OFFSET would read and discard all the rows before it.
+
+EXPORT_FIELDS = ["id", "firstname", "surname", "email", "language", "type", "status", "is_active",
+    "is_admin", "is_official", "is_chief", "alert_votes_up", "alert_votes_down",
+    "created_at", "last_login_done_at"]
+
+# The position after a row, opaque for the clients
+def encode_cursor(created_at: datetime, user_id: uuid_pkg.UUID) -> str:
+    raw = f"{created_at.isoformat()}|{user_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+# It raises ValueError if the cursor is not valid
+def decode_cursor(cursor: str) -> tuple[datetime, uuid_pkg.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, _, user_id = raw.partition("|")
+        return datetime.fromisoformat(created_at), uuid_pkg.UUID(user_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Cursor not valid")
+
+def filtered_users(query, user_type: str | None, status: str | None, is_active: bool | None):
+    if user_type is not None:
+        query = query.where(User.type == user_type)
+    if status is not None:
+        query = query.where(User.status == status)
+    if is_active is not None:
+        query = query.where(col(User.is_active) == is_active)
+    return query.order_by(User.created_at, User.id)
+
+# A page of users after the cursor, and the cursor of the next page (None on the last one)
+async def get_users_page(db_session, cursor: str | None, limit: int, user_type: str | None = None,
+        status: str | None = None, is_active: bool | None = None) -> tuple[list[User], str | None]:
+    q = filtered_users(select(User), user_type, status, is_active)
+    if cursor is not None:
+        created_at, user_id = decode_cursor(cursor)
+        q = q.where(tuple_(User.created_at, User.id) > tuple_(created_at, user_id))
+    users = (await db_session.exec(q.limit(limit + 1))).all() # one more: is there a next page?
+    if len(users) <= limit:
+        return users, None
+    users = users[:limit]
+    return users, encode_cursor(users[-1].created_at, users[-1].id)
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid_pkg.UUID):
+        return str(value)
+    return value
+
+# A spreadsheet runs a cell starting with one of these as a formula: names are written by
+# the users, so such values are exported as text (quoted)
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def csv_value(value):
+    value = export_value(value)
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+# CSV or NDJSON text, one piece per "chunk_size" users, read with a server side cursor (the
+# rows are never all in memory). It opens its own session: the response is streamed after
+# the request dependencies (and their session) are closed.
+async def export_users(engine, export_format: str, chunk_size: int, user_type: str | None = None,
+        status: str | None = None, is_active: bool | None = None):
+    columns = [getattr(User, name) for name in EXPORT_FIELDS]
+    q = filtered_users(select(*columns), user_type, status, is_active)
+    if export_format == "csv":
+        yield ",".join(EXPORT_FIELDS) + "\r\n"
+    async for db_session in get_async_session(engine):
+        result = await db_session.stream(q.execution_options(yield_per=chunk_size))
+        async for rows in result.partitions():
+            text = io.StringIO()
+            if export_format == "csv":
+                writer = csv.writer(text)
+                writer.writerows([[csv_value(value) for value in row] for row in rows])
+            else:
+                for row in rows:
+                    text.write(json.dumps(dict(zip(EXPORT_FIELDS, map(export_value, row)))) + "\n")
+            yield text.getvalue()
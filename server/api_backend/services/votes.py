@@ -0,0 +1,59 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import uuid as uuid_pkg
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import select, update
+from core.settings import settings
+from models.general import Alert, AlertVote, User, UserStatus
+from services.security import now_tz_naive
+
+# Votes are counted once (alert_votes has a unique (alert_id, user_id)) and they increment
+# the counters of the alert and of its author in the same transaction: the credibility of
+# an alert or of a user is read from two columns, never computed again from the votes.
+
+# Laplace smoothing: 0.5 without votes, it moves towards 0 or 1 as votes arrive
+def credibility(votes_up: int, votes_down: int) -> float:
+    return (votes_up + 1) / (votes_up + votes_down + 2)
+
+def insert_ignoring_duplicates(db_session):
+    if db_session.bind.dialect.name == "postgresql":
+        return postgresql.insert(AlertVote)
+    return sqlite.insert(AlertVote) # other databases (sqlite)
+
+# It returns (votes_up, votes_down, counted, author_marked_unreliable), counted is
+# False if the user had already voted the alert. The caller commits.
+async def add_vote(db_session, alert_id: int, author_id: uuid_pkg.UUID, voter_id: uuid_pkg.UUID,
+        is_valid: bool) -> tuple:
+    q = insert_ignoring_duplicates(db_session).values(alert_id=alert_id, user_id=voter_id,
+        is_valid=is_valid, created_at=now_tz_naive()).on_conflict_do_nothing(
+            index_elements=["alert_id", "user_id"]).returning(AlertVote.id)
+    if (await db_session.exec(q)).first() is None:
+        q = select(Alert.votes_up, Alert.votes_down).where(Alert.id == alert_id)
+        votes_up, votes_down = (await db_session.exec(q)).one()
+        return votes_up, votes_down, False, False
+    up, down = (1, 0) if is_valid else (0, 1)
+    q = update(Alert).where(Alert.id == alert_id).values(
+        votes_up=Alert.votes_up + up, votes_down=Alert.votes_down + down).returning(
+            Alert.votes_up, Alert.votes_down)
+    votes_up, votes_down = (await db_session.exec(q)).one()
+    await db_session.exec(update(User).where(User.id == author_id).values(
+        alert_votes_up=User.alert_votes_up + up, alert_votes_down=User.alert_votes_down + down))
+    marked = False
+    if down:
+        marked = await mark_unreliable(db_session, author_id)
+    return votes_up, votes_down, True, marked
+
+# An author whose alerts got at least CREDIBILITY_MIN_VOTES votes and whose credibility
+# is below CREDIBILITY_UNRELIABLE becomes unreliable
+async def mark_unreliable(db_session, user_id: uuid_pkg.UUID) -> bool:
+    votes = User.alert_votes_up + User.alert_votes_down
+    q = update(User).where(
+        (User.id == user_id) &
+        (User.status == UserStatus.ok) &
+        (votes >= settings.credibility_min_votes) &
+        (User.alert_votes_up + 1 < settings.credibility_unreliable * (votes + 2))
+        ).values(status=UserStatus.unreliable)
+    result = await db_session.exec(q)
+    return result.rowcount > 0
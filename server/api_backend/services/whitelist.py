@@ -0,0 +1,267 @@
+# Quidalert – a network alert manager: it receives alerts from users and makes decisions to help them
+# Copyright (C) 2025  Davide Quirillo
+# Licensed under the GNU GPL v3 or later. See LICENSE for details.
+
+import re
+import csv
+import codecs
+import math
+import time
+import logging
+from collections import deque
+from functools import lru_cache
+from email_validator import validate_email, EmailNotValidError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import select, func, col
+from core.dbmgr import get_async_session
+from models.general import WhiteRecord, UserType
+from services.security import get_email_hash, now_tz_naive
+
+logger = logging.getLogger("whitelist")
+
+whitelist_table = WhiteRecord.__table__
+
+MAX_REPORTED_ERRORS = 20
+MAX_GAP = 10000 # larger id jumps are skipped ids (not pending), the periodic rebuild adds anything missed
+USER_TYPES = {t.value for t in UserType}
+EMAIL_SHAPE = re.compile(r"[^@\s]{1,64}@[^@\s]{1,255}")
+
+# A Bloom filter of email hashes: "no" is certain, "yes" is wrong with probability
+# "error_rate" (when it holds "capacity" hashes). The bit positions come from the
+# email hash itself (a sha256), no other hashing is needed.
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)) # bits
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, email_hash: str):
+        h1 = int(email_hash[:16], 16)
+        h2 = int(email_hash[16:32], 16) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, email_hash: str):
+        for position in self._positions(email_hash):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, email_hash: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(email_hash))
+
+# Registrations are checked against the whitelist: an email whose hash isn't in the filter
+# is refused without a query (registration spam never reaches the database). Every server
+# worker has its own filter: it's loaded at startup, then the records added meanwhile (new
+# ids) are read every WHITELIST_REFRESH_SECONDS. Ids are assigned before the commit, so a
+# concurrent import can commit a lower id after a higher one: the missing ids are looked for
+# again during "gap_seconds" (as in AlertTail). Deleted records stay in the filter (a false
+# positive, the query answers) until the filter is rebuilt, when it's fuller than its capacity
+# or every "rebuild_seconds" (it adds any record still missed).
+class WhitelistFilter:
+    def __init__(self, capacity: int, error_rate: float, chunk_size: int, gap_seconds: float,
+            rebuild_seconds: float):
+        self.min_capacity = capacity
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.gap_seconds = gap_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.bloom = None # None until loaded: every email is looked up in the database
+        self.loaded_at = 0.0
+        self.last_id = 0
+        self.gaps: dict[int, float] = {} # missing id -> time it was noticed
+        self.rejected = 0
+        self.passed = 0
+
+    def might_contain(self, email_hash: str) -> bool:
+        if (self.bloom is not None) and (email_hash not in self.bloom):
+            self.rejected += 1
+            return False
+        self.passed += 1
+        return True
+
+    def add(self, email_hash: str):
+        if self.bloom is not None:
+            self.bloom.add(email_hash)
+
+    async def refresh(self, engine):
+        async for db_session in get_async_session(engine):
+            if (self.bloom is None) or (self.bloom.count > self.bloom.capacity) or (
+                    time.monotonic() - self.loaded_at > self.rebuild_seconds):
+                await self._rebuild(db_session)
+            else:
+                await self._load_gaps(db_session)
+                self.last_id = await load_hashes(db_session, self.bloom, self.last_id, self.chunk_size, self.gaps)
+
+    async def _rebuild(self, db_session):
+        loaded_at = time.monotonic()
+        count = (await db_session.exec(select(func.count()).select_from(WhiteRecord))).one()
+        bloom = BloomFilter(max(self.min_capacity, 2 * count), self.error_rate)
+        gaps = {}
+        last_id = await load_hashes(db_session, bloom, 0, self.chunk_size, gaps)
+        # the new filter replaces the old one when it's complete
+        self.bloom, self.last_id, self.gaps, self.loaded_at = bloom, last_id, gaps, loaded_at
+        logger.info(f"whitelist filter loaded, records={bloom.count} capacity={bloom.capacity} "
+            f"bytes={len(bloom.bits)}")
+
+    async def _load_gaps(self, db_session):
+        now = time.monotonic()
+        self.gaps = {i: t for i, t in self.gaps.items() if now - t < self.gap_seconds}
+        missing = list(self.gaps)
+        for first in range(0, len(missing), self.chunk_size):
+            q = select(WhiteRecord.id, WhiteRecord.email_hash).where(
+                col(WhiteRecord.id).in_(missing[first:first + self.chunk_size]))
+            for record_id, email_hash in (await db_session.exec(q)).all():
+                self.bloom.add(email_hash)
+                del self.gaps[record_id]
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.bloom is not None,
+            "gaps": len(self.gaps),
+            "records": self.bloom.count if self.bloom else 0,
+            "capacity": self.bloom.capacity if self.bloom else 0,
+            "rejected": self.rejected,
+            "looked_up": self.passed
+        }
+
+# It adds the hashes of the records with id > after_id (a server side cursor), the ids
+# skipped are put in "gaps", and it returns the last id read
+async def load_hashes(db_session, bloom: BloomFilter, after_id: int, chunk_size: int, gaps: dict) -> int:
+    now = time.monotonic()
+    q = select(WhiteRecord.id, WhiteRecord.email_hash).where(
+        col(WhiteRecord.id) > after_id).order_by(WhiteRecord.id)
+    result = await db_session.stream(q.execution_options(yield_per=chunk_size))
+    async for rows in result.partitions():
+        for record_id, email_hash in rows:
+            bloom.add(email_hash)
+            if record_id - after_id <= MAX_GAP:
+                for missing in range(after_id + 1, record_id):
+                    gaps[missing] = now
+            after_id = record_id
+    return after_id
+
+# Lines of an uploaded file, read "chunk_size" bytes at a time (read is an async function)
+async def iter_lines(read, chunk_size: int = 65536):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    while True:
+        chunk = await read(chunk_size)
+        pending += decoder.decode(chunk, final=not chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+        if not chunk:
+            break
+    if pending:
+        yield pending.rstrip("\r")
+
+# The state of the (excel dialect) CSV parser at the end of a line: True when it's inside
+# a quoted field (the record goes on in the next line)
+def in_quoted_field(line: str, quoted: bool = False) -> bool:
+    if '"' not in line:
+        return quoted
+    state = 2 if quoted else 0 # 0 field start, 1 field, 2 quoted field, 3 quote in a quoted field
+    for char in line:
+        if state == 2:
+            if char == '"':
+                state = 3
+        elif char == ",":
+            state = 0
+        elif (char == '"') and (state != 1): # a field starts quoted, or "" in a quoted field
+            state = 2
+        else:
+            state = 1
+    return state == 2
+
+# (line number, values) of the CSV records in lines (an async iterable of str). One csv.reader
+# reads all of them: it's given the lines of a record once the record is complete (quoted
+# fields can hold newlines), it never waits for more lines in the middle of a record.
+async def iter_csv_rows(lines):
+    pending = deque()
+    def take():
+        while pending:
+            yield pending.popleft()
+    reader = csv.reader(take())
+    quoted = False
+    async for line in lines:
+        pending.append(line + "\n")
+        quoted = in_quoted_field(line, quoted)
+        if not quoted:
+            yield reader.line_num + len(pending), next(reader)
+    if pending: # a quote not closed at the end of the file
+        pending[-1] = pending[-1][:-1]
+        yield reader.line_num + len(pending), next(reader)
+
+def upsert_whitelist(db_session):
+    dialect = postgresql if db_session.bind.dialect.name == "postgresql" else sqlite
+    q = dialect.insert(whitelist_table)
+    return q.on_conflict_do_update(index_elements=["email_hash"], set_={
+        "email": q.excluded.email, "firstname": q.excluded.firstname,
+        "surname": q.excluded.surname, "type": q.excluded.type})
+
+# Residents share a few domains: the (slow) domain validation is done once per domain.
+# The email is validated again, completely, when the user registers.
+@lru_cache(maxsize=4096)
+def is_valid_domain(domain: str) -> bool:
+    try:
+        validate_email(f"check@{domain}", check_deliverability=False)
+        return True
+    except EmailNotValidError:
+        return False
+
+# The rules of WhiteRecordIn, it returns an error message or None
+def check_record(fields: dict) -> str | None:
+    email = fields.get("email", "")
+    if (not EMAIL_SHAPE.fullmatch(email)) or (not is_valid_domain(email.rpartition("@")[2])):
+        return "email not valid"
+    if fields.get("type", UserType.citizen) not in USER_TYPES:
+        return "wrong type"
+    if (len(fields.get("firstname") or "") > 64) or (len(fields.get("surname") or "") > 64):
+        return "name too long"
+    return None
+
+# It imports CSV lines (an async iterable of str, the first record is the header with "email"
+# and optionally "firstname", "surname", "type"): a record with the same (normalized) email
+# is updated. Rows are written "batch_size" at a time, one transaction per batch.
+async def import_whitelist(db_session, lines, batch_size: int, whitelist_filter: WhitelistFilter | None = None) -> dict:
+    counts = {"rows": 0, "imported": 0, "invalid": 0, "errors": []}
+    header = None
+    batch = {}
+    async for line_number, values in iter_csv_rows(lines):
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            if "email" not in header:
+                raise ValueError("The CSV header must have an email column")
+            continue
+        counts["rows"] += 1
+        fields = {name: value.strip() for name, value in zip(header, values)
+            if name in ("email", "firstname", "surname", "type") and value.strip()}
+        error = check_record(fields)
+        if error is not None:
+            counts["invalid"] += 1
+            if len(counts["errors"]) < MAX_REPORTED_ERRORS:
+                counts["errors"].append(f"line {line_number}: {error}")
+            continue
+        email_hash = get_email_hash(fields["email"])
+        # one row per email in a statement (the last one wins)
+        batch[email_hash] = {"email": fields["email"].lower(), "email_hash": email_hash,
+            "firstname": fields.get("firstname"), "surname": fields.get("surname"),
+            "type": fields.get("type", UserType.citizen), "created_at": now_tz_naive()}
+        if len(batch) >= batch_size:
+            counts["imported"] += await write_batch(db_session, batch, whitelist_filter)
+            batch = {}
+    if batch:
+        counts["imported"] += await write_batch(db_session, batch, whitelist_filter)
+    return counts
+
+async def write_batch(db_session, batch: dict, whitelist_filter: WhitelistFilter | None) -> int:
+    # one statement executed for every row (compiled once, sent as multi-row batches)
+    await db_session.exec(upsert_whitelist(db_session), params=list(batch.values()))
+    await db_session.commit()
+    if whitelist_filter is not None:
+        for email_hash in batch:
+            whitelist_filter.add(email_hash)
+    return len(batch)
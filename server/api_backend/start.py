@@ -8,6 +8,7 @@ import os
 from dotenv import load_dotenv
 import uvicorn
 import api
+from core.settings import settings
 
 app = api.app
 
@@ -23,5 +24,7 @@ if (__name__ ==  "__main__"):
     fn = os.path.basename(__file__)
     sname = os.path.splitext(fn)[0]
     print(f"Starting api server in development mode on {h}:{p}...")
+    max_conn = w * (settings.db_pool_size + settings.db_max_overflow)
+    print(f"Database pool: up to {max_conn} connections ({w} workers), keep them below postgres max_connections")
     uvicorn.run(f"{sname}:app", host=h, port=p, 
         log_level=lev, reload=r, workers=w)